@@ -23,28 +23,55 @@ def haversine(lon1, lat1, lon2, lat2):
     c = 2 * np.arcsin(np.sqrt(a))
     return np.degrees(c)
 
-def ipc_write(name, ra, dec, op, p):
-    # fast pyarrow IPC serialization
+def ipc_write(name, ra, dec, op, p, pointing=None):
+    # fast pyarrow IPC serialization. For batch queries, pass the index
+    # of the pointing of each result as pointing; it's stored as the
+    # first column.
     outbuf = io.BytesIO()
     out = pa.output_stream(outbuf)
     a = pa.Tensor.from_numpy(p);   pa.ipc.write_tensor(a, out)
     a = pa.Tensor.from_numpy(op);  pa.ipc.write_tensor(a, out)
-    data = [ pa.array(name), pa.array(ra), pa.array(dec) ]
-    batch = pa.record_batch(data, names=['name', 'ra', 'dec'])
+    data, names = [ pa.array(name), pa.array(ra), pa.array(dec) ], ['name', 'ra', 'dec']
+    if pointing is not None:
+        data, names = [ pa.array(pointing) ] + data, ['pointing'] + names
+    batch = pa.record_batch(data, names=names)
     with pa.ipc.new_stream(out, batch.schema) as writer:
       writer.write_batch(batch)
     return outbuf.getvalue()
 
-def ipc_read(msg):
+def _ipc_read(msg):
     with pa.input_stream(memoryview(msg)) as fp:
         fp.seek(0)
         p  = pa.ipc.read_tensor(fp)
         op = pa.ipc.read_tensor(fp)
         with pa.ipc.open_stream(fp) as reader:
-            schema = reader.schema
-            r = next(reader)
+            r = reader.read_all()
+
+    return r, p.to_numpy(), op.to_numpy()
+
+def ipc_read(msg):
+    r, p, op = _ipc_read(msg)
+    return r["name"].to_numpy(), r["ra"].to_numpy(), r["dec"].to_numpy(), p, op
+
+def ipc_read_batch(msg):
+    # read the response to a batch query (see ipc_write)
+    r, p, op = _ipc_read(msg)
+    return r["pointing"].to_numpy(), r["name"].to_numpy(), r["ra"].to_numpy(), r["dec"].to_numpy(), p, op
+
+def ipc_write_pointings(t, ra, dec, radius):
+    # serialize the pointings of a batch query, as an Arrow IPC stream
+    # with columns t, ra, dec and radius (radius may be a scalar)
+    t, ra, dec, radius = np.broadcast_arrays(*map(np.atleast_1d, (t, ra, dec, radius)))
+    batch = pa.record_batch([ pa.array(np.asarray(c, dtype=np.float64)) for c in (t, ra, dec, radius) ], names=['t', 'ra', 'dec', 'radius'])
+    outbuf = io.BytesIO()
+    with pa.ipc.new_stream(outbuf, batch.schema) as writer:
+        writer.write_batch(batch)
+    return outbuf.getvalue()
 
-    return r["name"].to_numpy(zero_copy_only=False), r["ra"].to_numpy(), r["dec"].to_numpy(), p.to_numpy(), op.to_numpy()
+def ipc_read_pointings(msg):
+    with pa.ipc.open_stream(memoryview(msg)) as reader:
+        r = reader.read_all()
+    return tuple(r[name].to_numpy() for name in ('t', 'ra', 'dec', 'radius'))
 
 def utc_to_night(mjd, obscode='X03'):
     assert obscode == 'X03'
@@ -52,17 +79,96 @@ def utc_to_night(mjd, obscode='X03'):
     night = (localtime - 0.5).astype(int)
     return night
 
-def build_healpix_index(comps, nside, dt_minutes=5):
+class PixelIndex:
+    # Mapping from healpix pixel to the ndarray of indices of objects
+    # that passed through it, in one or more time slices. Stored in CSR
+    # form as two flat arrays: the offsets (nslices*npix+1) of the lists
+    # of each (slice, pixel) -- slice-major -- and the concatenated,
+    # sorted, object lists. The k-th slice covers times tedges[k] to
+    # tedges[k+1] (tedges=None means a single slice, covering the whole
+    # interpolation period).
+    #
+    # len(idx) is the number of pixels, and idx[pixel] the objects that
+    # passed through the pixel at any time.
+    def __init__(self, offsets, values, tedges=None):
+        self.offsets, self.values, self.tedges = offsets, values, tedges
+        self.nslices = 1 if tedges is None else len(tedges) - 1
+        self.npix = (len(offsets) - 1) // self.nslices
+
+    def __len__(self):
+        return self.npix
+
+    def __getitem__(self, k):
+        if self.nslices == 1:
+            return self.values[self.offsets[k]:self.offsets[k+1]]
+        return np.unique(self.gather([k]))
+
+    def slices(self, t=None):
+        # the indices of the time slices covering time t (all, if t is None)
+        if t is None or self.tedges is None:
+            return np.arange(self.nslices)
+        return np.flatnonzero((self.tedges[:-1] <= t) & (t <= self.tedges[1:]))
+
+    def gather(self, pixels, t=None):
+        # the concatenated object lists of the given pixels, in the time
+        # slice(s) covering time t (or in all slices, if t is None). An
+        # object may appear more than once.
+        rows = (self.slices(t)[:, None] * self.npix + np.asarray(pixels)).reshape(-1)
+        begin, end = self.offsets[rows], self.offsets[rows + 1]
+        counts = end - begin
+        # the position of each output element within values: the start of
+        # its list, plus its position within it
+        pos = np.arange(counts.sum()) + np.repeat(begin - (np.cumsum(counts) - counts), counts)
+        return self.values[pos]
+
+def merge_pixel_indices(indices, sizes):
+    #
+    # Merges PixelIndexes of consecutive blocks of objects (the k-th block
+    # holding sizes[k] objects) into one, with object indices offset by
+    # the number of objects in the preceding blocks. Each list is the
+    # concatenation of its lists in each block, so stays sorted.
     #
-    # Computes a dictionary where the key are healpix indices
-    # (NSIDE, nested) and the values are the lists (ndarrays)
-    # of objects (their indices, actually) that have passed
-    # through that pixel in the period covered by the interpolation.
+    tedges = indices[0].tedges
+    assert all(np.array_equal(idx.tedges, tedges) for idx in indices), "All indices must have the same time slices"
+    counts = [ np.diff(idx.offsets) for idx in indices ]
+    nrows = len(counts[0])
+    assert all(len(c) == nrows for c in counts), "All indices must have the same number of pixels"
+
+    offsets = np.zeros(nrows + 1, dtype=np.int64)
+    np.cumsum(np.sum(counts, axis=0), out=offsets[1:])
+    nobj = int(np.sum(sizes))
+    values = np.empty(offsets[-1], dtype=np.int32 if nobj < 2**31 else np.int64)
+
+    # copy each block's lists to where they go in the merged index: after
+    # the lists of the preceding blocks in the same (slice, pixel)
+    dest = offsets[:-1].copy()
+    delta = 0
+    for idx, c, size in zip(indices, counts, sizes):
+        row = np.repeat(np.arange(nrows), c)
+        values[dest[row] + np.arange(len(row)) - idx.offsets[row]] = idx.values[idx.offsets[0]:idx.offsets[-1]] + delta
+        dest += c
+        delta += size
+
+    return PixelIndex(offsets, values, tedges)
+
+def build_healpix_index(comps, nside, dt_minutes=5, slice_minutes=60):
+    #
+    # Computes an index mapping healpix pixels (NSIDE, nested) to the
+    # lists (ndarrays) of objects (their indices, actually) that have
+    # passed through that pixel in the period covered by the interpolation.
     # This is done by computing the position of the object from
     # tmin to tmax, evedy dt_minutes minutes.
     #
-    # The returned dictionary lets the user quickly get a
-    # list of asteroids that passed through a given pixel.
+    # The period is split into time slices of slice_minutes, each with
+    # its own pixel -> objects lists, so that a query at time t needs to
+    # look only at the objects that were near the pointing around t
+    # (rather than at any time during the night, which, for fast movers,
+    # is many more). Pass slice_minutes=None for a single slice.
+    #
+    # The index is returned as a PixelIndex: flat arrays with the
+    # per-(slice, pixel) offsets and the concatenated object lists, which
+    # lets the user quickly get a list of asteroids that passed through
+    # a given pixel.
     #
     # Example:
     #   > h2l = build_healpix_index(comps, nside=128)
@@ -71,42 +177,59 @@ def build_healpix_index(comps, nside, dt_minutes=5):
     #   [   1739   20004  223389  418207  824376  880008 1062034 1252353]
     #
 
-    # compute position vector
+    # compute position vector (also at tmax, so the samples span the
+    # whole period of validity)
     (tmin, tmax), op, p, objects = comps
-    t = np.arange(tmin, tmax, dt_minutes/(24*60))
+    t = np.append(np.arange(tmin, tmax, dt_minutes/(24*60)), tmax)
     objects, xyz = decompress(t, comps, return_ephem=False)
 
     # compute healpix pixel corresponding to this vector
+    #     shape = (len(objects), len(t))
     x, y, z = xyz
     ipix = hp.vec2pix(nside, x, y, z, nest=True)
 
-    # object IDs corresponding to each ipix entry
-    #     shape = (len(objects), len(t))
-    # it looks like:
-    #    array([[      0,       0,       0, ...,       0,       0,       0],
-    #           [      1,       1,       1, ...,       1,       1,       1],
-    #            ...,
-    i = np.tile(np.arange(ipix.shape[0]), (ipix.shape[1], 1)).T
-
-    # flatten
-    ipix = ipix.reshape(-1)
-    i = i.reshape(-1)
-    
-    # Now the goal is to jointly sort the ipix and i array, so that ipix is the key and i is the value
-    idx = np.argsort(ipix)
-    ipix_sorted = ipix[idx]
-    astid_sorted = i[idx]
-
-    # Now we build the { hpix -> [ ast_id ] } dictionary -- this is our index.
-    # initialize dict mapping to empty arrays
-    h2l = dict( map(lambda key: (key, np.zeros(0, dtype=int)), range(hp.nside2npix(nside))) )
-
-    # fill out pixels where there are asteroids
-    hpix, limits, counts = np.unique(ipix_sorted, return_index=True, return_counts=True)
-    for h, l, c in zip(hpix, limits, counts):
-        h2l[h] = np.unique(astid_sorted[l:l+c])
-
-    return h2l
+    per_slice = len(t) if slice_minutes is None else max(1, int(round(slice_minutes / dt_minutes)))
+    return pixel_index(ipix, hp.nside2npix(nside), t, per_slice)
+
+def pixel_index(ipix, npix, t=None, per_slice=None):
+    #
+    # Builds a PixelIndex from ipix, an (nobj, nt) array of the pixels
+    # each object was in at each of nt times t, with per_slice samples per
+    # time slice (by default, a single slice).
+    #
+    # Consecutive slices share their boundary sample, so any time within
+    # a slice is bracketed by samples that are in it.
+    #
+    nobj, nt = ipix.shape
+    if per_slice is None or per_slice >= nt - 1:
+        per_slice = max(1, nt - 1)
+    starts = np.arange(0, max(1, nt - 1), per_slice)
+    ends = np.minimum(starts + per_slice, nt - 1)
+    tedges = None if t is None or len(starts) == 1 else np.append(t[starts], t[-1])
+
+    keys = []
+    for k, (j0, j1) in enumerate(zip(starts, ends)):
+        sp = ipix[:, j0:j1+1]
+
+        # objects move slowly relative to the sampling; drop consecutive
+        # samples that stayed in the same pixel before sorting
+        keep = np.ones(sp.shape, dtype=bool)
+        keep[:, 1:] = sp[:, 1:] != sp[:, :-1]
+        i = np.broadcast_to(np.arange(nobj)[:, None], sp.shape)[keep]
+
+        # the row of each (slice, pixel) in the index, combined with the
+        # object into a single key
+        keys.append((k * npix + sp[keep].astype(np.int64)) * nobj + i)
+
+    # Now jointly sort (and deduplicate) the (row, object) pairs, with the
+    # row as the key
+    key = np.unique(np.concatenate(keys))
+    row, astid = np.divmod(key, nobj)
+
+    # per-row offsets into the (sorted) object list -- this is our index
+    offsets = np.zeros(len(starts) * npix + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=len(starts) * npix), out=offsets[1:])
+    return PixelIndex(offsets, astid.astype(np.int32 if nobj < 2**31 else np.int64), tedges)
 
 def compress(df, cheby_order = 4, observer_cheby_order = 7):
     # make sure the input is sorted by ObjID and time.
@@ -192,8 +315,6 @@ def decompress(t_mjd, comps, return_ephem=False):
         return objects, xyz, cart_to_sph(xyz)
 
 def merge_comps(compslist):
-    from tqdm import tqdm
-
     # verify tmin/tmax are the same everywhere
     for i, (comps, idx) in enumerate(compslist):
         assert comps[0] == compslist[0][0][0], f"Interpolation limits don't match, {comps[0]} != {compslist[0][0][0]} at index={i}"
@@ -210,26 +331,162 @@ def merge_comps(compslist):
     objects = np.asarray(objects)
 
     # merge indices
-    allidx = dict( map(lambda key: (key, []), range(len(idx))) )
-    delta = 0
-    for comps, idx in tqdm(compslist):
-        _, _, _, o = comps
-        for i in range(len(allidx)):
-            allidx[i].append(idx[i] + delta)
-        delta += len(o)
-    for i in range(len(allidx)):
-        allidx[i] = np.concatenate(allidx[i])
-    idx = allidx
+    idx = merge_pixel_indices([ idx for _, idx in compslist ], [ len(comps[3]) for comps, _ in compslist ])
 
     comps = (tmin, tmax), op, p, objects
     return comps, idx
 
+#
+# On-disk cache format
+#
+# A small header followed by page-aligned sections of raw arrays, so the
+# file can be memory-mapped: opening it takes milliseconds regardless of
+# its size, pages get read in only when a query touches them, and all
+# processes serving the same file share them through the OS page cache.
+#
+#   magic        8 bytes, b"ASTCHECK"
+#   version      uint32 (little endian)
+#   header size  uint32
+#   header       JSON: tmin, tmax, and for each section its
+#                offset (from the start of the file), dtype and shape
+#   sections     each starting at a multiple of CACHE_ALIGN bytes:
+#     op             observer chebys, (observer_order+1, 3)
+#     p              asteroid chebys, stored object-major as
+#                    (nobj, order+1, 3), so that the coefficients of
+#                    an object are contiguous on disk
+#     names_offsets  (nobj+1,) start of each name in names_bytes
+#     names_bytes    the UTF-8 encoded names, concatenated
+#     idx_offsets    (nslices*npix+1,) start of each (slice, pixel)'s
+#                    list in idx_values
+#     idx_values     the indices of objects in each (slice, pixel),
+#                    concatenated
+#     idx_tedges     (nslices+1,) time slice boundaries; present only if
+#                    the index has more than one slice
+#
+# Version 1 files (no time slices), and files written with pickle (the
+# format before version 1), are still read by read_comps.
+#
+CACHE_MAGIC = b"ASTCHECK"
+CACHE_VERSION = 2
+CACHE_ALIGN = 4096
+
+class Names:
+    # Read-only array-like of object names, stored as a blob of UTF-8
+    # bytes and the offsets of each name within it. Indexing with an
+    # integer returns a str; with a slice, a boolean mask or an array of
+    # indices, it returns an ndarray of str (objects), decoding only the
+    # selected names.
+    def __init__(self, offsets, data):
+        self.offsets, self.data = offsets, data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _name(self, k):
+        return bytes(self.data[self.offsets[k]:self.offsets[k+1]]).decode()
+
+    def __getitem__(self, k):
+        if np.isscalar(k):
+            return self._name(k)
+        ii = np.arange(len(self))[k]
+        ret = np.empty(len(ii), dtype=object)
+        ret[:] = [ self._name(i) for i in ii ]
+        return ret
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:].astype(dtype) if dtype is not None else self[:]
+
+def _names_to_blob(objects):
+    encoded = [ str(name).encode() for name in objects ]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([ len(b) for b in encoded ], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+def _index_to_arrays(idx, nobj):
+    # the CSR arrays of a (legacy) dict index
+    lists = [ idx[k] for k in range(len(idx)) ]
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([ len(l) for l in lists ], out=offsets[1:])
+    values = np.concatenate(lists).astype(np.int32 if nobj < 2**31 else np.int64)
+    return offsets, values
+
 def write_comps(fp, comps, idx):
-    pickle.dump(comps, fp, protocol=pickle.HIGHEST_PROTOCOL)
-    pickle.dump(idx, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    #
+    # Write the compressed ephemerides and their healpix index (may be None)
+    # to fp, in the memory-mappable format described above.
+    #
+    import json, struct
+
+    (tmin, tmax), op, p, objects = comps
+    sections = dict(op=op, p=np.transpose(p, (2, 0, 1)))
+    sections["names_offsets"], sections["names_bytes"] = _names_to_blob(objects)
+    if idx is not None:
+        sections["idx_offsets"], sections["idx_values"] = idx.offsets, idx.values
+        if idx.tedges is not None:
+            sections["idx_tedges"] = idx.tedges
+    sections = { name: np.ascontiguousarray(a, dtype=a.dtype.newbyteorder("<")) for name, a in sections.items() }
+
+    # lay out the sections; the header must fit before the first one
+    def align(n):
+        return (n + CACHE_ALIGN - 1) // CACHE_ALIGN * CACHE_ALIGN
+    offset, layout = 0, {}
+    for name, a in sections.items():
+        layout[name] = dict(offset=offset, dtype=a.dtype.str, shape=a.shape)
+        offset = align(offset + a.nbytes)
+    header = dict(tmin=float(tmin), tmax=float(tmax), sections=layout)
+    start = align(len(CACHE_MAGIC) + 8 + len(json.dumps(header)) + 1024)
+    for desc in layout.values():
+        desc["offset"] += start
+    header = json.dumps(header).encode()
+    assert len(CACHE_MAGIC) + 8 + len(header) <= start
+
+    # write, padding with zeros up to the start of each section
+    fp.write(CACHE_MAGIC + struct.pack("<II", CACHE_VERSION, len(header)) + header)
+    pos = len(CACHE_MAGIC) + 8 + len(header)
+    for name, a in sections.items():
+        fp.write(b"\0" * (layout[name]["offset"] - pos))
+        fp.write(a.data)
+        pos = layout[name]["offset"] + a.nbytes
 
 def read_comps(fp):
-    return (pickle.load(fp), pickle.load(fp))
+    #
+    # Read the compressed ephemerides and the healpix index from fp (a
+    # file opened in binary mode). The arrays are memory-mapped views into
+    # the file (the mapping stays valid after fp is closed); object names
+    # are returned as a Names, and the index as a PixelIndex.
+    #
+    # Returns: (comps, idx)
+    #
+    import json, struct
+
+    magic = fp.read(len(CACHE_MAGIC))
+    if magic != CACHE_MAGIC:
+        # legacy (pickled) cache, with a dict index
+        fp.seek(0)
+        comps, idx = pickle.load(fp), pickle.load(fp)
+        return comps, PixelIndex(*_index_to_arrays(idx, len(comps[3])))
+
+    version, hlen = struct.unpack("<II", fp.read(8))
+    if version not in (1, CACHE_VERSION):
+        raise Exception(f"Unsupported ephemerides cache version {version} (expected {CACHE_VERSION})")
+    header = json.loads(fp.read(hlen))
+
+    buf = np.memmap(fp, dtype=np.uint8, mode="r")
+    def section(name):
+        desc = header["sections"][name]
+        dtype = np.dtype(desc["dtype"])
+        nbytes = dtype.itemsize * int(np.prod(desc["shape"]))
+        return buf[desc["offset"]:desc["offset"] + nbytes].view(dtype).reshape(desc["shape"])
+
+    op = section("op")
+    p = section("p").transpose(1, 2, 0)
+    objects = Names(section("names_offsets"), section("names_bytes"))
+    idx = None
+    if "idx_offsets" in header["sections"]:
+        tedges = section("idx_tedges") if "idx_tedges" in header["sections"] else None
+        idx = PixelIndex(section("idx_offsets"), section("idx_values"), tedges)
+
+    return ((header["tmin"], header["tmax"]), op, p, objects), idx
 
 def _aux_compress(fn, nside=128, verify=True, tolerance_arcsec=1):
     df = pd.read_hdf(fn)
@@ -296,7 +553,7 @@ def query(comps, idx, t, ra, dec, radius, use_index=True):
         # find plausible asteroids
         nside = hp.npix2nside(len(idx))
         hpix = hp.query_disc(nside, pointing, radius=radius, inclusive=True, nest=True)
-        ast = np.unique(np.concatenate([ idx[k] for k in hpix ]))
+        ast = np.unique(idx.gather(hpix, t))
 
         # extract chebys only for plausible asteroids
         (tmin, tmax), op, p, objects = comps
@@ -321,6 +578,63 @@ def query(comps, idx, t, ra, dec, radius, use_index=True):
     name, (ra, dec), p = objects[mask], cart_to_sph(xyz[:, mask]), p[:, :, mask]
     return name, ra, dec, p, op
 
+def query_batch(comps, idx, t, ra, dec, radius):
+    #
+    # Like query(), but for many pointings at once: t, ra, dec and radius
+    # are arrays (or scalars, broadcast against them). The chebys are
+    # evaluated once per distinct time, for the union of the candidates
+    # of all pointings at that time.
+    #
+    # Returns: (pointing, name, ra, dec, p, op), where pointing is the
+    #          index of the pointing each result belongs to; results are
+    #          ordered by pointing.
+    #
+    t, ra, dec, radius = np.broadcast_arrays(*map(np.atleast_1d, (t, ra, dec, radius)))
+    radius = np.radians(radius)
+    ra_rad, dec_rad = np.radians(ra), np.radians(dec)
+    pointing = np.asarray([ np.cos(dec_rad) * np.cos(ra_rad), np.cos(dec_rad) * np.sin(ra_rad), np.sin(dec_rad) ])
+    cos_radius = np.cos(radius)
+
+    (tmin, tmax), op, p, objects = comps
+    if idx is not None:
+        nside = hp.npix2nside(len(idx))
+
+    # (pointing, object) pairs of results, collected for each distinct time
+    result_k, result_ast, result_xyz = [ np.zeros(0, dtype=int) ], [ np.zeros(0, dtype=int) ], [ np.zeros((3, 0)) ]
+    times, tinv = np.unique(t, return_inverse=True)
+    for j, tj in enumerate(times):
+        kk = np.flatnonzero(tinv == j)
+
+        if idx is not None:
+            # (pointing, candidate) pairs from the index
+            cands = [ np.unique(idx.gather(hp.query_disc(nside, pointing[:, k], radius=radius[k], inclusive=True, nest=True), tj)) for k in kk ]
+            pair_k = np.repeat(kk, [ len(c) for c in cands ])
+            pair_ast = np.concatenate(cands) if len(cands) else np.zeros(0, dtype=int)
+            ast = np.unique(pair_ast)
+            pair_col = np.searchsorted(ast, pair_ast)
+        else:
+            # every object is a candidate for every pointing
+            ast = np.arange(len(objects))
+            pair_k, pair_col = np.repeat(kk, len(ast)), np.tile(ast, len(kk))
+
+        # decompress the union of candidates, once, and turn to unit vectors
+        _, xyz = decompress(tj, ((tmin, tmax), op, p[:, :, ast], ast), return_ephem=False)
+        xyz /= np.sqrt((xyz*xyz).sum(axis=0))
+
+        # query the positions via dot-product, pair by pair
+        dotprod = (xyz[:, pair_col] * pointing[:, pair_k]).sum(axis=0)
+        mask = dotprod > cos_radius[pair_k]
+        result_k.append(pair_k[mask])
+        result_ast.append(ast[pair_col[mask]])
+        result_xyz.append(xyz[:, pair_col[mask]])
+
+    # select the results, ordered by pointing
+    k, ast, xyz = np.concatenate(result_k), np.concatenate(result_ast), np.concatenate(result_xyz, axis=1)
+    order = np.argsort(k, kind="stable")
+    k, ast, xyz = k[order], ast[order], xyz[:, order]
+    name, (ra, dec) = objects[ast], cart_to_sph(xyz)
+    return k, name, ra, dec, p[:, :, ast], op
+
 def query_service(url, t, ra, dec, radius):
     params = {
         "t": t,
@@ -344,6 +658,23 @@ def query_service(url, t, ra, dec, radius):
     else:
         print("Failed to query /ephemerides/ service. Status code:", response.status_code)
 
+def query_service_batch(url, t, ra, dec, radius):
+    # POST a batch of pointings to the /ephemerides/batch endpoint
+    # (url is its full address), returning what query_batch returns.
+    try:
+        response = requests.post(url, data=ipc_write_pointings(t, ra, dec, radius), headers={"Content-Type": "application/octet-stream"})
+    except requests.exceptions.ConnectionError as e:
+        print("failed to connect to the remote ephemerides service. details:", file=sys.stderr)
+        print(e, file=sys.stderr)
+        exit(-1)
+
+    # Check if the request was successful
+    if response.status_code == 200:
+        # Deserialie the response
+        return ipc_read_batch(response.content)
+    else:
+        print("Failed to query /ephemerides/batch service. Status code:", response.status_code)
+
 def cmd_serve(args):
     # This will be read by the Settings in the service
     import os
@@ -14,14 +14,17 @@ settings = Settings()
 from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Load the ML model
+    # Map the ephemerides cache. This is near-instant, and the pages are
+    # shared between all worker processes serving the same file (legacy,
+    # pickled, caches get loaded into memory instead).
     global comps, idx
     fn = settings.cache_path
     info(f"Loading ephemerides cache from {fn}.")
+    t0 = time.perf_counter()
     with open(fn, "rb") as fp:
         comps, idx = ac.read_comps(fp)
 
-    info("Cache loaded.")
+    info(f"Cache loaded ({len(comps[3]):,} objects, {(time.perf_counter() - t0)*1000:.2f} msec).")
 
     yield
 
@@ -49,6 +52,23 @@ import pickle
 import pyarrow as pa
 import io
 
+@app.post("/ephemerides/batch")
+async def read_ephemerides_batch(request: Request):
+    # The body is an Arrow IPC stream of pointings, with columns t, ra,
+    # dec and radius (see ac.ipc_write_pointings). The response is a
+    # single Arrow stream of the results of all pointings, each tagged
+    # with the index of its pointing (see ac.ipc_read_batch).
+    t, ra, dec, radius = ac.ipc_read_pointings(await request.body())
+
+    t0 = time.perf_counter()
+    pointing, name, ra, dec, p, op = ac.query_batch(comps, idx, t, ra, dec, radius)
+    duration = time.perf_counter() - t0
+
+    info(f"# pointings: {len(t)}, # objects: {len(name)}, compute time: {duration*1000:.2f}msec")
+
+    ret = ac.ipc_write(name, ra, dec, op, p, pointing=pointing)
+    return Response(content=ret, media_type='application/octet-stream')
+
 @app.get("/ephemerides/")
 async def read_ephemerides(t: float, ra: float, dec: float, radius: float):
     # performance
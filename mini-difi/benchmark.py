@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+# Survey-scale benchmarks for miniDifi
+#
+# Generates a synthetic catalog of observations (objects moving along great
+# circle-ish paths, observed on some nights, a few visits per night), links
+# it with each engine, and times the individual stages. The results are
+# appended as JSON lines to an output file, so regressions can be tracked.
+#
+# Example:
+#
+#   ./benchmark.py --rows 1e6 1e7 --engines batched multiprocess --output bench.jsonl
+#
+# For large catalogs, pass --data-dir to write the synthetic catalog to a
+# memory-mapped .npy file (it's generated in chunks, so it never has to fit
+# in memory).
+#
+
+import numpy as np
+import time, os, json
+
+obsDtype = np.dtype([
+    ("ssObjectId", "u8"),
+    ("diaSourceId", "u8"),
+    ("midPointTai", "f8"),
+    ("ra", "f8"),
+    ("decl", "f8"),
+])
+
+def synthesize(nobj, nights=365, nightsObserved=20, visits=3, rate=0.25, visitSpacing_minutes=30, seed=42, out=None, chunksize=100_000):
+    #
+    # Generate a synthetic catalog of nobj*nightsObserved*visits observations,
+    # sorted by (ssObjectId, midPointTai).
+    #
+    #  - nights:         length of the survey (nights)
+    #  - nightsObserved: number of (distinct) nights each object is observed on
+    #  - visits:         number of visits per night, visitSpacing_minutes apart
+    #  - rate:           typical rate of motion (degrees/day); actual rates
+    #                    are log-normally distributed around it.
+    #
+    # If out is given, the observations are written into it (e.g., a
+    # memory-mapped array); otherwise, a new array is returned.
+    #
+    rng = np.random.default_rng(seed)
+    nrows = nobj * nightsObserved * visits
+    if out is None:
+        out = np.empty(nrows, dtype=obsDtype)
+    assert len(out) == nrows
+
+    mjd0 = 60000
+    perObj = nightsObserved * visits
+    for k0 in range(0, nobj, chunksize):
+        n = min(chunksize, nobj - k0)
+
+        # orbits: a starting position and a (constant) motion vector
+        ra0 = rng.uniform(0, 360, n)
+        dec0 = np.degrees(np.arcsin(rng.uniform(-0.95, 0.95, n)))
+        speed = rate * rng.lognormal(0, 0.7, n)
+        pa = rng.uniform(0, 2*np.pi, n)
+
+        # distinct observed nights, with random gaps
+        gaps = rng.integers(1, max(2, 2*nights // nightsObserved), size=(n, nightsObserved))
+        night = mjd0 + rng.integers(0, max(1, nights // 4), size=(n, 1)) + np.cumsum(gaps, axis=1)
+
+        # visits within each night
+        t = night[:, :, None] + 0.1 + np.arange(visits) * visitSpacing_minutes / (24*60) + rng.uniform(0, 1e-3, (n, nightsObserved, visits))
+        t = t.reshape(n, perObj)
+
+        dt = t - mjd0
+        dec = np.clip(dec0[:, None] + speed[:, None] * np.cos(pa)[:, None] * dt, -89.9, 89.9)
+        ra = (ra0[:, None] + speed[:, None] * np.sin(pa)[:, None] * dt / np.cos(np.radians(dec))) % 360
+
+        rows = out[k0*perObj:(k0 + n)*perObj]
+        rows["ssObjectId"] = np.repeat(np.arange(k0, k0 + n, dtype=np.uint64), perObj)
+        rows["diaSourceId"] = np.arange(k0*perObj, (k0 + n)*perObj, dtype=np.uint64)
+        rows["midPointTai"] = t.reshape(-1)
+        rows["ra"] = ra.reshape(-1)
+        rows["decl"] = dec.reshape(-1)
+
+    return out
+
+def run_batched(obsv, config, outfn, metrics, **kwargs):
+    import miniDifi as md
+
+    with metrics.timer("groupby"):
+        ssObjects, i, offsets = md.groupBy(obsv["ssObjectId"], obsv["midPointTai"], parallel=True)
+    with metrics.timer("setup"):
+        obj = np.zeros(len(ssObjects), dtype=md.objectDtype(ssObjects.dtype))
+        obj["ssObjectId"] = ssObjects
+    # (times the "tracklets" and "discovery" stages)
+    md.linkGroups(i, offsets, obsv["midPointTai"], obsv["ra"], obsv["decl"], obsv["diaSourceId"], obj, **config, metrics=metrics)
+    with metrics.timer("output"):
+        write_output(outfn, obj)
+    return obj
+
+def run_object(obsv, config, outfn, metrics, **kwargs):
+    import miniDifi as md
+
+    with metrics.timer("groupby"):
+        ssObjects, i, offsets = md.groupBy(obsv["ssObjectId"], obsv["midPointTai"])
+    with metrics.timer("setup"):
+        obj = np.zeros(len(ssObjects), dtype=md.objectDtype(ssObjects.dtype))
+        keys = md.objectKeys(ssObjects)
+        cols = obsv[["diaSourceId", "midPointTai", "ra", "decl"]]
+    for k in range(len(obj)):
+        obj[k] = (ssObjects[k], *md.linkObject(cols[i[offsets[k]:offsets[k+1]]], key=keys[k], **config, metrics=metrics))
+    with metrics.timer("output"):
+        write_output(outfn, obj)
+    return obj
+
+def run_multiprocess(obsv, config, outfn, metrics, nworkers=os.cpu_count(), chunksize=1000, **kwargs):
+    import miniDifi as md
+
+    with metrics.timer("groupby"):
+        _, perm, offsets = md.groupBy(obsv["ssObjectId"], obsv["midPointTai"], parallel=True)
+    # (times the "compile" and (wall-clock) "link" stages, and sums the
+    # "tracklets" and "discovery" stages over all workers)
+    obj = md.MockLinker(config).link_all(obsv, (perm, offsets), chunksize=chunksize, nworkers=nworkers, metrics=metrics)
+    with metrics.timer("output"):
+        write_output(outfn, obj)
+    return obj
+
+engines = {
+    "object": run_object,
+    "batched": run_batched,
+    "multiprocess": run_multiprocess,
+}
+
+def write_output(outfn, obj):
+    if outfn is not None:
+        np.save(outfn, obj)
+
+def load_or_synthesize(nrows, args):
+    # the synthetic catalog with (about) nrows rows
+    perObj = args.nights_observed * args.visits
+    nobj = max(1, int(nrows) // perObj)
+    params = dict(nobj=nobj, nights=args.nights, nightsObserved=args.nights_observed, visits=args.visits, rate=args.rate, seed=args.seed)
+
+    if args.data_dir is None:
+        return synthesize(**params), params
+
+    # cache the catalog in a memory-mapped .npy, keyed by its parameters
+    fn = os.path.join(args.data_dir, "synth-" + "-".join(f"{k}={v}" for k, v in params.items()) + ".npy")
+    if not os.path.exists(fn):
+        out = np.lib.format.open_memmap(fn + ".tmp", mode="w+", dtype=obsDtype, shape=(nobj*perObj,))
+        synthesize(**params, out=out)
+        out.flush()
+        del out
+        os.rename(fn + ".tmp", fn)
+    return np.load(fn, mmap_mode="r"), params
+
+def _bench(engine, nrows, args, config):
+    # run one engine on one catalog; runs in a fresh process (see main)
+    import miniDifi as md
+
+    obsv, params = load_or_synthesize(nrows, args)
+    outfn = os.path.join(args.data_dir, f"ssObject.{engine}.npy") if args.data_dir else None
+
+    # warm up (JIT compilation or cache loading), on a tiny catalog. The
+    # engines collect the timings of their stages into metrics.
+    metrics = md.Metrics()
+    with metrics.timer("warmup"):
+        engines[engine](synthesize(10), config, None, md.Metrics(), nworkers=args.nworkers, chunksize=1)
+
+    t0 = time.perf_counter()
+    obj = engines[engine](obsv, config, outfn, metrics, nworkers=args.nworkers, chunksize=args.chunksize)
+    total = time.perf_counter() - t0
+
+    return dict(
+        engine=engine,
+        nrows=len(obsv),
+        nobj=len(obj),
+        nfound=int((~np.isnan(obj["discoverySubmissionDate"])).sum()),
+        params=params,
+        config=config,
+        nworkers=args.nworkers if engine == "multiprocess" else None,
+        stages=metrics.timers,
+        total=total,
+        rows_per_second=len(obsv) / total,
+        objects_per_second=len(obj) / total,
+    )
+
+def git_commit():
+    import subprocess
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    import argparse, platform, datetime
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from miniDifi import config
+
+    parser = argparse.ArgumentParser(description='Benchmark the miniDifi linking engines on synthetic catalogs.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e6], help='Catalog sizes (number of observations).')
+    parser.add_argument('--engines', type=str, nargs='+', choices=list(engines), default=["batched", "multiprocess"], help='Engines to benchmark.')
+    parser.add_argument('--nights', type=int, default=365, help='Length of the survey (nights).')
+    parser.add_argument('--nights-observed', type=int, default=20, help='Number of nights each object is observed on.')
+    parser.add_argument('--visits', type=int, default=3, help='Number of visits per night.')
+    parser.add_argument('--rate', type=float, default=0.25, help='Typical rate of motion (deg/day).')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed of the synthetic catalog.')
+    parser.add_argument('--nworkers', type=int, default=os.cpu_count(), help='Number of workers for the multiprocess engine.')
+    parser.add_argument('--chunksize', type=int, default=1000, help='Objects per chunk for the multiprocess engine.')
+    parser.add_argument('--data-dir', type=str, default=None, help='Directory to store the (memory-mapped) catalogs and outputs in.')
+    parser.add_argument('--output', type=str, default="benchmark.jsonl", help='File to append the (JSON lines) results to.')
+    args = parser.parse_args()
+    if args.data_dir is not None:
+        os.makedirs(args.data_dir, exist_ok=True)
+
+    meta = dict(
+        date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        commit=git_commit(),
+        host=platform.node(),
+        cpu_count=os.cpu_count(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+    )
+
+    # each benchmark runs in a fresh process, so that the JIT compilation,
+    # caches and memory use of one engine don't affect another
+    ctx = multiprocessing.get_context("spawn")
+    for nrows in args.rows:
+        for engine in args.engines:
+            with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                result = pool.submit(_bench, engine, nrows, args, config).result()
+            result.update(meta)
+
+            with open(args.output, "a") as fp:
+                fp.write(json.dumps(result) + "\n")
+
+            stages = ", ".join(f"{k}={v:.3f}s" for k, v in result["stages"].items())
+            print(f"{engine:12s} rows={result['nrows']:,} objects={result['nobj']:,} total={result['total']:.3f}s "
+                  f"({result['objects_per_second']:,.0f} obj/s) [{stages}]")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# Distributed (multi-node) linking
+#
+# Splits diaSource into shards by a hash of the object ID -- so every object
+# is entirely within one shard -- and links the shards independently, on a
+# Dask cluster or a local pool of processes. Both the shards and the results
+# are Parquet datasets, partitioned by shard:
+#
+#   {outdir}/diaSource/shard=00012/part-00000.parquet, ...
+#   {outdir}/ssObject/shard=00012/part-0.parquet
+#
+# so they can live on a shared filesystem (or object store) that all nodes
+# see, and be read back with pyarrow.dataset / pandas as a single table.
+#
+# Example:
+#
+#   # on a local pool of 8 processes
+#   ./distdifi.py diaSource.npy out/ --nshards 64 --nworkers 8
+#
+#   # on an existing Dask cluster
+#   ./distdifi.py diaSource.npy out/ --nshards 1024 --backend dask --scheduler tcp://head:8786
+#
+# Because each object's random numbers depend only on its ID (see
+# miniDifi.objectKeys), the results don't depend on the number of shards or
+# workers.
+#
+
+import numpy as np
+import os
+import miniDifi as md
+
+def shardOf(ids, nshards):
+    # the shard of each object ID: its random number key (see
+    # miniDifi.objectKeys), scrambled with a splitmix64 finalizer so that
+    # sequential integer IDs spread evenly, modulo nshards.
+    h = md.objectKeys(ids)
+    with np.errstate(over="ignore"):
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        h = h ^ (h >> np.uint64(31))
+    return (h % np.uint64(nshards)).astype(np.int64)
+
+def shardDir(outdir, table, shard):
+    return os.path.join(outdir, table, f"shard={shard:05d}")
+
+def shardObservations(source, outdir, nshards, objectId="ssObjectId", chunksize=10_000_000):
+    # split the observations in source (a .npy file, or a Parquet file or
+    # dataset; see miniDifi.readChunks) into nshards shards by object ID
+    # hash, written to {outdir}/diaSource/shard=NNNNN/. The input is
+    # streamed, chunksize rows at a time, each chunk adding one file to
+    # every shard it has observations for.
+    #
+    # Returns: the number of observations in each shard
+    import pyarrow as pa, pyarrow.parquet as pq
+
+    # files left over from an earlier run would end up in the shards
+    assert not os.path.exists(os.path.join(outdir, "diaSource")), f"{outdir}/diaSource already exists"
+
+    counts = np.zeros(nshards, dtype=np.int64)
+    for c, chunk in enumerate(md.readChunks(source, chunksize)):
+        shard = shardOf(chunk[objectId], nshards)
+        order = np.argsort(shard, kind="stable")
+        bounds = np.searchsorted(shard[order], np.arange(nshards + 1))
+
+        for s in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[s]:bounds[s+1]]
+            table = pa.table({ name: col[rows] for name, col in chunk.items() })
+
+            dn = shardDir(outdir, "diaSource", s)
+            os.makedirs(dn, exist_ok=True)
+            pq.write_table(table, os.path.join(dn, f"part-{c:05d}.parquet"))
+            counts[s] += len(rows)
+
+    return counts
+
+def linkShard(outdir, shard, config=md.config, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl"):
+    # link all objects of one shard, writing the results to
+    # {outdir}/ssObject/shard=NNNNN/part-0.parquet.
+    #
+    # Returns: (shard, metrics), where metrics is a dict (see miniDifi.Metrics)
+    import pyarrow.dataset as ds
+
+    metrics = md.Metrics()
+    with metrics.timer("total"):
+        dn = shardDir(outdir, "diaSource", shard)
+        with metrics.timer("read"):
+            obsv = md.asColumns(ds.dataset(dn, format="parquet").to_table(columns=[objectId, sourceId, mjdTime, ra, dec]))
+
+        with metrics.timer("groupby"):
+            ssObjects, i, offsets = md.groupBy(obsv[objectId], obsv[mjdTime], parallel=True)
+        obj = np.zeros(len(ssObjects), dtype=md.objectDtype(ssObjects.dtype))
+        obj["ssObjectId"] = ssObjects
+        md.linkGroups(i, offsets, obsv[mjdTime], obsv[ra], obsv[dec], obsv[sourceId], obj, **config, metrics=metrics)
+
+        with metrics.timer("output"):
+            dn = shardDir(outdir, "ssObject", shard)
+            os.makedirs(dn, exist_ok=True)
+            with md.ParquetWriter(os.path.join(dn, "part-0.parquet")) as writer:
+                writer.write(obj)
+
+    return shard, metrics.asdict()
+
+def linkShards(outdir, shards, backend="multiprocessing", nworkers=os.cpu_count(), client=None, config=md.config, tqdm=None):
+    # link the given shards, in parallel, on:
+    #
+    #  - "multiprocessing": a local pool of nworkers (spawned) processes
+    #  - "dask":            a Dask cluster; pass a distributed.Client as
+    #                       client (by default, a LocalCluster of nworkers
+    #                       processes is started)
+    #
+    # Returns: a miniDifi.Metrics with the merged metrics of all shards
+    #          (with a per-shard breakdown)
+    metrics = md.Metrics()
+    progress = tqdm(total=len(shards)) if tqdm is not None else None
+
+    def collect(results):
+        for shard, shardMetrics in results:
+            metrics.merge(shardMetrics, worker=f"shard={shard:05d}")
+            if progress is not None:
+                progress.update(1)
+
+    with metrics.timer("link"):
+        if backend == "multiprocessing":
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(nworkers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [ pool.submit(linkShard, outdir, shard, config) for shard in shards ]
+                collect(f.result() for f in as_completed(futures))
+        elif backend == "dask":
+            from dask.distributed import Client, LocalCluster, as_completed
+            ownClient = client is None
+            if ownClient:
+                client = Client(LocalCluster(n_workers=nworkers, threads_per_worker=1, processes=True))
+            try:
+                futures = client.map(linkShard, [outdir]*len(shards), shards, config=config, pure=False)
+                collect(f.result() for f in as_completed(futures))
+            finally:
+                if ownClient:
+                    client.close()
+        else:
+            raise Exception(f"Unknown backend {backend}")
+
+    if progress is not None:
+        progress.close()
+
+    return metrics
+
+def readResults(outdir):
+    # the linking results of all shards, as a pyarrow Table (with a "shard"
+    # column)
+    import pyarrow.dataset as ds
+    return ds.dataset(os.path.join(outdir, "ssObject"), format="parquet", partitioning="hive").to_table()
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Link diaSources across a cluster, sharded by object ID.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('source', type=str, help='Input observations (a .npy file, or a Parquet file or dataset).')
+    parser.add_argument('outdir', type=str, help='Output directory (for the diaSource shards and the ssObject results).')
+    parser.add_argument('--nshards', type=int, default=64, help='Number of shards.')
+    parser.add_argument('--backend', type=str, choices=["multiprocessing", "dask"], default="multiprocessing", help='Where to run the linking.')
+    parser.add_argument('--nworkers', type=int, default=os.cpu_count(), help='Number of local worker processes (multiprocessing, or a local Dask cluster).')
+    parser.add_argument('--scheduler', type=str, default=None, help='Address of the Dask scheduler (default: start a local cluster).')
+    parser.add_argument('--chunksize', type=int, default=10_000_000, help='Rows per chunk when sharding the input.')
+    parser.add_argument('--skip-sharding', action='store_true', help='Reuse the shards in outdir from a previous run.')
+    args = parser.parse_args()
+
+    if not args.skip_sharding:
+        print(f"Sharding {args.source} into {args.nshards} shards... ", end='', flush=True)
+        counts = shardObservations(args.source, args.outdir, args.nshards, chunksize=args.chunksize)
+        print(f"done ({counts.sum():,} observations; {counts.min():,} to {counts.max():,} per shard).")
+    shards = [ s for s in range(args.nshards) if os.path.exists(shardDir(args.outdir, "diaSource", s)) ]
+
+    client = None
+    if args.scheduler is not None:
+        from dask.distributed import Client
+        client = Client(args.scheduler)
+
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        tqdm = None
+    metrics = linkShards(args.outdir, shards, backend=args.backend, nworkers=args.nworkers, client=client, tqdm=tqdm)
+
+    with open(os.path.join(args.outdir, "ssObject.metrics.json"), "w") as fp:
+        fp.write(metrics.json(indent=2))
+
+    obj = readResults(args.outdir)
+    nfound = (~np.isnan(obj.column("discoverySubmissionDate").to_numpy())).sum()
+    print(f"Objects: {len(obj):,}, found: {nfound:,}")
+
+if __name__ == "__main__":
+    main()
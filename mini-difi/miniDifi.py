@@ -1,7 +1,18 @@
 #!/usr/bin/env python
 
 import numpy as np
-from numba import njit
+from numba import njit, prange
+
+# default linking configuration
+config = dict(
+    seed=0,
+
+    maxdt_minutes=90,
+    minlen_arcsec=1.,
+    window=14,
+    nlink=3,
+    p=0.95
+)
 
 @njit(cache=True)
 def haversine_np(lon1, lat1, lon2, lat2):
@@ -30,14 +41,18 @@ def hasTracklet(mjd, ra, dec, maxdt_minutes, minlen_arcsec):
     Given a set of observations in one night, calculate it has at least one
     detectable tracklet.
     
-    Inputs: numpy arrays of mjd (time, days), ra (degrees), dec(degrees).
+    Inputs: numpy arrays of mjd (time, days), ra (degrees), dec(degrees),
+            SORTED BY TIME (!).
     
     Output: True or False
     """
     ## a tracklet must be longer than some minimum separation (1arcsec)
     ## and shorter than some maximum time (90 minutes). We find
-    ## tracklets by taking all observations in a night and computing
-    ## all of theirs pairwise distances, then selecting on that.
+    ## tracklets by sweeping through the (time-sorted) observations, and
+    ## for each one testing only the earlier observations that are within
+    ## maxdt of it (a sliding window, [lo, j)). This makes the cost
+    ## O(n*k), where k is the number of observations within maxdt, rather
+    ## than O(n^2).
     nobs = len(ra)
     if nobs < 2:
         return False
@@ -45,13 +60,31 @@ def hasTracklet(mjd, ra, dec, maxdt_minutes, minlen_arcsec):
     maxdt = maxdt_minutes / (60*24)
     minlen = minlen_arcsec / 3600
 
-    for i in range(nobs):
-        for j in range(nobs):
-            diff = mjd[i] - mjd[j]
-            if diff > 0 and diff < maxdt:
-                sep = haversine_np(ra[i], dec[i], ra[j], dec[j])
-                if sep > minlen:
-                    return True
+    lo = 0
+    for j in range(1, nobs):
+        # drop observations that are too far back in time
+        while lo < j and mjd[j] - mjd[lo] >= maxdt:
+            lo += 1
+
+        for i in range(lo, j):
+            diff = mjd[j] - mjd[i]
+            if diff <= 0:
+                continue
+
+            # quick tests before computing the distance: the separation
+            # is at least |ddec|, and at most |ddec| + |dra|.
+            ddec = abs(dec[j] - dec[i])
+            if ddec > minlen:
+                return True
+            dra = abs(ra[j] - ra[i])
+            if dra > 180:
+                dra = 360 - dra
+            if ddec + dra <= minlen:
+                continue
+
+            sep = haversine_np(ra[i], dec[i], ra[j], dec[j])
+            if sep > minlen:
+                return True
 
     return False
 
@@ -78,11 +111,231 @@ def trackletsInNights(night, mjd, ra, dec, maxdt_minutes, minlen_arcsec):
 
     return nights, hasTrk
 
+# The same tests, on positions precomputed as 3D unit vectors. The batched
+# kernels convert each object's positions once, so the inner loop compares
+# pair separations to a threshold with no trigonometry at all. Rather than
+# comparing the dot product to cos(minlen) -- which loses most of its
+# precision for arcsecond separations, as cos(1") = 1 - 1.2e-11 -- we
+# compare the squared chord |a - b|^2 to (2 sin(minlen/2))^2. The two are
+# equivalent (|a - b|^2 = 2 - 2 a.b), but the latter is well-conditioned.
+
 @njit(cache=True)
-def discoveryOpportunities(nights, nightHasTracklets, window, nlink, p, seed):
-    # set seed
-    np.random.seed(seed)
-    
+def unitVectors(ra, dec):
+    # (n, 3) array of unit vectors for ra, dec (degrees)
+    xyz = np.empty((len(ra), 3))
+    for i in range(len(ra)):
+        r, d = np.radians(ra[i]), np.radians(dec[i])
+        cd = np.cos(d)
+        xyz[i, 0] = cd * np.cos(r)
+        xyz[i, 1] = cd * np.sin(r)
+        xyz[i, 2] = np.sin(d)
+    return xyz
+
+@njit(cache=True)
+def minChord2(minlen_arcsec):
+    # squared chord length of a minlen_arcsec great circle arc
+    return (2 * np.sin(np.radians(minlen_arcsec / 3600) / 2))**2
+
+@njit(cache=True)
+def hasTrackletXYZ(mjd, xyz, maxdt_minutes, chord2):
+    # hasTracklet(), given unit vectors xyz (see unitVectors) and the
+    # squared chord length threshold chord2 (see minChord2).
+    nobs = len(mjd)
+    if nobs < 2:
+        return False
+
+    maxdt = maxdt_minutes / (60*24)
+
+    lo = 0
+    for j in range(1, nobs):
+        while lo < j and mjd[j] - mjd[lo] >= maxdt:
+            lo += 1
+
+        for i in range(lo, j):
+            if mjd[j] - mjd[i] <= 0:
+                continue
+
+            dx = xyz[j, 0] - xyz[i, 0]
+            dy = xyz[j, 1] - xyz[i, 1]
+            dz = xyz[j, 2] - xyz[i, 2]
+            if dx*dx + dy*dy + dz*dz > chord2:
+                return True
+
+    return False
+
+@njit(cache=True)
+def trackletsInNightsXYZ(night, mjd, xyz, maxdt_minutes, minlen_arcsec):
+    # trackletsInNights(), given unit vectors xyz (see unitVectors).
+    nights = np.unique(night)
+    hasTrk = np.zeros(len(nights), dtype='bool')
+    chord2 = minChord2(minlen_arcsec)
+
+    i = np.searchsorted(night, nights, side='right')
+
+    b = 0
+    for k, e in enumerate(i):
+        hasTrk[k] = hasTrackletXYZ(mjd[b:e], xyz[b:e], maxdt_minutes, chord2)
+        b = e
+
+    return nights, hasTrk
+
+# Tracklet emission: the same test as hasTrackletXYZ, but rather than
+# stopping at the first qualifying pair, the pairs themselves are appended
+# to a (growable) buffer of (obs_i, obs_j) index pairs -- e.g., to build
+# discovery packets, or to validate against other implementations. The
+# flags-only kernels above are left as they are, so linking keeps its
+# early exit.
+
+@njit(cache=True)
+def _growPairs(buf):
+    # a copy of the pairs buffer, with twice the capacity
+    new = np.empty((max(2*len(buf), 16), 2), dtype=buf.dtype)
+    new[:len(buf)] = buf
+    return new
+
+@njit(cache=True)
+def trackletPairsXYZ(mjd, xyz, idx, maxdt_minutes, chord2, maxPairs, buf, n):
+    # append the pairs (idx[i], idx[j]) of observations of a single night,
+    # SORTED BY TIME (!), that make discoverable tracklets to buf, whose
+    # first n rows are in use. Pairs are emitted in order of their later
+    # observation (j), and then the earlier one (i), and at most maxPairs
+    # of them (all, if maxPairs <= 0).
+    #
+    # Returns: (buf, n), where buf may have been reallocated to make room.
+    nobs = len(mjd)
+    maxdt = maxdt_minutes / (60*24)
+
+    found = 0
+    lo = 0
+    for j in range(1, nobs):
+        while lo < j and mjd[j] - mjd[lo] >= maxdt:
+            lo += 1
+
+        for i in range(lo, j):
+            if mjd[j] - mjd[i] <= 0:
+                continue
+
+            dx = xyz[j, 0] - xyz[i, 0]
+            dy = xyz[j, 1] - xyz[i, 1]
+            dz = xyz[j, 2] - xyz[i, 2]
+            if dx*dx + dy*dy + dz*dz > chord2:
+                if n == len(buf):
+                    buf = _growPairs(buf)
+                buf[n, 0], buf[n, 1] = idx[i], idx[j]
+                n += 1
+                found += 1
+                if maxPairs > 0 and found == maxPairs:
+                    return buf, n
+
+    return buf, n
+
+@njit(cache=True)
+def trackletPairs(perm, offsets, mjd, ra, dec, maxdt_minutes, minlen_arcsec, maxPerNight, buf):
+    # find the tracklets of all objects, given a (perm, offsets) group-by
+    # index (see trackletNights). Up to maxPerNight (all, if <= 0) pairs
+    # are emitted per night, into buf (an (n, 2) int64 array, grown as
+    # needed), as row indices into mjd/ra/dec.
+    #
+    # Returns: (pairOffsets, buf, n), where the pairs of object k are
+    #          buf[pairOffsets[k]:pairOffsets[k+1]], and n is the total
+    #          number of pairs.
+    nobj = len(offsets) - 1
+    pairOffsets = np.zeros(nobj + 1, dtype=np.int64)
+    chord2 = minChord2(minlen_arcsec)
+
+    n = 0
+    for k in range(nobj):
+        idx = perm[offsets[k]:offsets[k+1]]
+        m = mjd[idx]
+        xyz = unitVectors(ra[idx], dec[idx])
+        night = m.astype(np.int64)  ## FIXME: works only for LSST
+
+        # each run of observations on the same night
+        b = 0
+        for e in range(1, len(idx) + 1):
+            if e == len(idx) or night[e] != night[b]:
+                buf, n = trackletPairsXYZ(m[b:e], xyz[b:e], idx[b:e], maxdt_minutes, chord2, maxPerNight, buf, n)
+                b = e
+        pairOffsets[k+1] = n
+
+    return pairOffsets, buf, n
+
+# Counter-based random numbers (Philox-4x32-10; Salmon et al. 2011)
+#
+# Every random number is a pure function of (seed, object key, stream,
+# draw index), so any object's draws can be computed anywhere -- in any
+# thread, process or order -- with no generator state to carry around or
+# reseed. This is what keeps the linking results deterministic no matter
+# how objects are distributed between threads and workers.
+PHILOX_M0, PHILOX_M1 = np.uint64(0xD2511F53), np.uint64(0xCD9E8D57)
+PHILOX_W0, PHILOX_W1 = np.uint64(0x9E3779B9), np.uint64(0xBB67AE85)
+MASK32 = np.uint64(0xFFFF_FFFF)
+
+@njit(cache=True)
+def philox4x32(c0, c1, c2, c3, k0, k1):
+    # Philox-4x32 with 10 rounds. All inputs and outputs are uint64s
+    # holding 32-bit values.
+    for r in range(10):
+        p0, p1 = PHILOX_M0 * c0, PHILOX_M1 * c2
+        c0, c1, c2, c3 = (p1 >> np.uint64(32)) ^ c1 ^ k0, p1 & MASK32, (p0 >> np.uint64(32)) ^ c3 ^ k1, p0 & MASK32
+        k0, k1 = (k0 + PHILOX_W0) & MASK32, (k1 + PHILOX_W1) & MASK32
+    return c0, c1, c2, c3
+
+@njit(cache=True)
+def uniform(seed, key, stream, i):
+    # the i-th uniform deviate in [0, 1) of the given stream, for the
+    # object with the given key. The counter is (i, stream, key), and
+    # the Philox key is the global seed.
+    seed, key = np.uint64(seed), np.uint64(key)
+    x0, x1, _, _ = philox4x32(np.uint64(i) & MASK32, np.uint64(stream) & MASK32, key & MASK32, key >> np.uint64(32),
+                              seed & MASK32, seed >> np.uint64(32))
+    # 53 random bits -> double
+    return ((x0 >> np.uint64(5)) * 67108864.0 + (x1 >> np.uint64(6))) / 9007199254740992.0
+
+@njit(cache=True)
+def uniforms(seed, key, stream, n):
+    # the first n deviates of a stream
+    u = np.empty(n)
+    for i in range(n):
+        u[i] = uniform(seed, key, stream, i)
+    return u
+
+@njit(cache=True)
+def _hashIds(chars):
+    # FNV-1a over the (nonzero) characters of each row, with a
+    # splitmix64 finalizer to mix the bits.
+    keys = np.empty(chars.shape[0], dtype=np.uint64)
+    for k in range(chars.shape[0]):
+        n = chars.shape[1]
+        while n > 0 and chars[k, n-1] == 0:
+            n -= 1
+        h = np.uint64(0xCBF29CE484222325)
+        for c in range(n):
+            h = (h ^ np.uint64(chars[k, c])) * np.uint64(0x100000001B3)
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        keys[k] = h ^ (h >> np.uint64(31))
+    return keys
+
+def objectKeys(ids):
+    # turn object IDs into the 64-bit keys of their random number streams.
+    # Integer IDs are used as-is; string IDs are hashed (so that the same
+    # ID gives the same key irrespective of the width of the string dtype).
+    ids = np.asarray(ids)
+    if ids.dtype.kind in "iu":
+        return ids.astype(np.uint64)
+    if ids.dtype.kind not in "SU":
+        ids = ids.astype("U")
+    width = ids.dtype.itemsize if ids.dtype.kind == "S" else ids.dtype.itemsize // 4
+    chars = np.ascontiguousarray(ids).view("u1" if ids.dtype.kind == "S" else "u4").reshape(len(ids), width)
+    return _hashIds(chars)
+
+@njit(cache=True)
+def uniqueOpportunities(nights, nightHasTracklets, window, nlink, seed, key):
+    # Return the nights with unique discovery opportunities. Random numbers
+    # (used to tell the opportunities apart) come from stream 0 of the
+    # object's counter-based generator (see uniform()).
+
     # Find all nights where a trailing window of <window> nights
     # (including the current night) has at least <nlink> tracklets.
     #
@@ -115,54 +368,403 @@ def discoveryOpportunities(nights, nightHasTracklets, window, nlink, p, seed):
     #    discovery opportunity. We then find unique discovery
     #    opportunities by filtering on when the sums change.
     arr2 = np.zeros(nlen)
-    arr2[nights - n0] = np.random.rand(len(nights))
+    arr2[nights - n0] = uniforms(seed, key, 0, len(nights))
     arr2 = arr2.cumsum()
     arr[window:] -= arr[:-window].copy()
     arr2 = arr2[disc - n0]
     arr2[1:] -= arr2[:-1].copy()
     disc = disc[arr2.nonzero()]
-    
+
+    return disc
+
+@njit(cache=True)
+def discoveryOpportunities(nights, nightHasTracklets, window, nlink, p, seed, key):
+    # Returns: (discIdx, disc), the unique discovery opportunities (see
+    #          uniqueOpportunities) and the index of the one where the
+    #          object was discovered (or -1).
+    disc = uniqueOpportunities(nights, nightHasTracklets, window, nlink, seed, key)
+
     # finally, at every discovery opportunity we have a probability <p>
-    # to discover the object. Figure out when we'll discover it.
-    discN = (np.random.rand(len(disc)) < p).nonzero()[0]
+    # to discover the object. Figure out when we'll discover it. The draws
+    # come from stream 1 of the object's generator.
+    discN = (uniforms(seed, key, 1, len(disc)) < p).nonzero()[0]
     discIdx = discN[0] if len(discN) else -1
 
     return discIdx, disc
 
-def linkObject(obsv, seed, maxdt_minutes=90, minlen_arcsec=1., window=14, nlink=3, p=0.95):
+def linkObject(obsv, seed, key=0, maxdt_minutes=90, minlen_arcsec=1., window=14, nlink=3, p=0.95, metrics=None):
+    # obsv: the observations of a single object, SORTED BY TIME (!), e.g.
+    #       a slice of observations in groupBy() order
+    # key:  the random number stream key of this object (see objectKeys)
+    # metrics: an optional Metrics instance; the time spent looking for
+    #       tracklets and discovery opportunities is added to its
+    #       "tracklets" and "discovery" stages (as in linkGroups)
     discoveryObservationId = 0xFFFF_FFFF_FFFF_FFFF
     discoverySubmissionDate = np.nan
     discoveryChances = 0
 
     if len(obsv):
-        i = np.argsort(obsv["midPointTai"])
-        obsv = obsv[i]
         night = obsv["midPointTai"].astype(int)  ## FIXME: works only for LSST
         mjd, ra, dec, diaSourceId = obsv["midPointTai"], obsv["ra"], obsv["decl"], obsv["diaSourceId"]
 
-        # compute a random seed for this object, based on the hash of its (sorted) data
-        # this keeps all outputs deterministics across the full catalog in multithreading
-        # scenarios (where different objects are distributed to different threads)
-        # note: becasue np.random.seed expects a uint32, we truncate the hash to 4 bytes.
-        import hashlib
-        seed += int.from_bytes(hashlib.sha256(ra.tobytes()).digest()[-4:], "little", signed=False)
-        seed %= 0xFFFF_FFFF
-
+        if metrics is not None:
+            import time
+            t0 = time.perf_counter()
         nights, hasTrk = trackletsInNights(night, mjd, ra, dec, maxdt_minutes, minlen_arcsec)
-        discIdx, discNights = discoveryOpportunities(nights, hasTrk, window, nlink, p, seed)
+        if metrics is not None:
+            t1 = time.perf_counter()
+            metrics.add("tracklets", t1 - t0)
+        discIdx, discNights = discoveryOpportunities(nights, hasTrk, window, nlink, p, seed, key)
+        if metrics is not None:
+            metrics.add("discovery", time.perf_counter() - t1)
         if discIdx != -1:
             discoveryChances = len(discNights)
             discoverySubmissionDate = discNights[discIdx]
 
-            # find the first observation on the discovery date
-            i, j = np.searchsorted(night, [discoverySubmissionDate, discoverySubmissionDate+1])
-            k = i + np.argmin(mjd[i:j])
-            discoveryObservationId = diaSourceId[k]
+            # the first observation on the discovery date
+            i = np.searchsorted(night, discoverySubmissionDate)
+            discoveryObservationId = diaSourceId[i]
 
     return discoveryObservationId, discoverySubmissionDate, discoveryChances
 
-def linkObservations(obsv, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl"):
-    # expects a ndarray of observations, with the following columns:
+@njit(parallel=True, cache=True)
+def trackletNights(perm, offsets, mjd, ra, dec, maxdt_minutes, minlen_arcsec):
+    # run trackletsInNights for all objects in one go. The observations of
+    # object k are expected to be at perm[offsets[k]:offsets[k+1]] of
+    # mjd/ra/dec, SORTED BY OBSERVATION TIME (!), i.e., (perm, offsets) is
+    # a group-by index as returned by groupBy(). The columns themselves
+    # can be in any order, so they don't need to be gathered (copied)
+    # beforehand.
+    #
+    # Returns: (nightOffsets, nights, hasTrk), where the nights with
+    #          observations of object k, and whether they have a
+    #          discoverable tracklet, are at [nightOffsets[k], nightOffsets[k+1])
+    #          of nights and hasTrk.
+    nobj = len(offsets) - 1
+
+    # count the nights of each object, to know where its output goes
+    counts = np.zeros(nobj + 1, dtype=np.int64)
+    for k in prange(nobj):
+        n = 0
+        for i in range(offsets[k], offsets[k+1]):
+            if i == offsets[k] or np.int64(mjd[perm[i]]) != np.int64(mjd[perm[i-1]]):
+                n += 1
+        counts[k+1] = n
+    nightOffsets = counts.cumsum()
+
+    nights = np.empty(nightOffsets[-1], dtype=np.int64)
+    hasTrk = np.empty(nightOffsets[-1], dtype=np.bool_)
+    for k in prange(nobj):
+        b, e = offsets[k], offsets[k+1]
+        if b == e:
+            continue
+
+        idx = perm[b:e]
+        m = mjd[idx]
+        night = m.astype(np.int64)  ## FIXME: works only for LSST
+        n, t = trackletsInNightsXYZ(night, m, unitVectors(ra[idx], dec[idx]), maxdt_minutes, minlen_arcsec)
+        nights[nightOffsets[k]:nightOffsets[k+1]] = n
+        hasTrk[nightOffsets[k]:nightOffsets[k+1]] = t
+
+    return nightOffsets, nights, hasTrk
+
+@njit(parallel=True, cache=True)
+def discoverBatch(nightOffsets, nights, hasTrk, perm, offsets, mjd, diaSourceId, seed, keys, window, nlink, p,
+                  discoveryObservationId, discoverySubmissionDate, discoveryChances):
+    # run discoveryOpportunities for all objects in one go, given the
+    # output of trackletNights (and the same group-by index). The results are written into the output
+    # arrays (indexed by object) for objects that were discovered; rows of
+    # undiscovered objects are left untouched, so the caller must
+    # pre-initialize them.
+    #
+    # Note: random numbers are a function of (seed, keys[k]) only, so the
+    #       results don't depend on how objects are distributed to threads.
+    for k in prange(len(nightOffsets) - 1):
+        nb, ne = nightOffsets[k], nightOffsets[k+1]
+        if nb == ne:
+            continue
+
+        discIdx, discNights = discoveryOpportunities(nights[nb:ne], hasTrk[nb:ne], window, nlink, p, seed, keys[k])
+        if discIdx != -1:
+            date = discNights[discIdx]
+            discoveryChances[k] = len(discNights)
+            discoverySubmissionDate[k] = date
+
+            # the first observation on the discovery date (the observations
+            # are time-sorted, so it's the first one past midnight)
+            idx = perm[offsets[k]:offsets[k+1]]
+            discoveryObservationId[k] = diaSourceId[idx[np.searchsorted(mjd[idx], date)]]
+
+def objectDtype(idDtype):
+    # the dtype of the linking output, given the dtype of object IDs
+    return np.dtype([
+        ("ssObjectId", idDtype),
+        ("discoveryObservationId", "u8"),
+        ("discoverySubmissionDate", "f8"),
+        ("discoveryChances", "i4")
+    ])
+
+def initObjects(obj):
+    # pre-initialize the output to the "not discovered" state
+    obj["discoveryObservationId"] = 0xFFFF_FFFF_FFFF_FFFF
+    obj["discoverySubmissionDate"] = np.nan
+    obj["discoveryChances"] = 0
+
+class Metrics:
+    # Timers and counters for the stages of the linking pipeline, e.g.:
+    #
+    #   metrics = Metrics()
+    #   with metrics.timer("groupby"):
+    #       ...
+    #   metrics.count("objects", len(obj))
+    #   print(metrics.json())
+    #
+    # Stages are timed per call (not per object or observation), so this is
+    # cheap enough to leave on in production. Metrics collected in worker
+    # processes are combined with merge(), which also keeps a per-worker
+    # breakdown.
+
+    def __init__(self):
+        self.timers, self.counters, self.workers = {}, {}, {}
+
+    def add(self, stage, seconds):
+        self.timers[stage] = self.timers.get(stage, 0.) + seconds
+
+    def timer(self, stage):
+        import time
+        metrics = self
+        class _timer:
+            def __enter__(self):
+                self.t0 = time.perf_counter()
+            def __exit__(self, *args):
+                metrics.add(stage, time.perf_counter() - self.t0)
+        return _timer()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def merge(self, other, worker=None):
+        # add in the timers and counters of other (Metrics, or a dict
+        # returned by asdict()), crediting them to worker (if given)
+        if isinstance(other, Metrics):
+            other = other.asdict()
+        for stage, seconds in other["timers"].items():
+            self.add(stage, seconds)
+        for name, n in other["counters"].items():
+            self.count(name, n)
+        if worker is not None:
+            self.workers.setdefault(str(worker), Metrics()).merge(other)
+
+    def asdict(self):
+        # the rates are per second of the "total" stage if there is one,
+        # otherwise per second spent in all stages (e.g., a worker's busy
+        # time)
+        seconds = self.timers.get("total", sum(self.timers.values()))
+        d = dict(timers=dict(self.timers), counters=dict(self.counters))
+        for name in ["objects", "observations"]:
+            if name in self.counters and seconds > 0:
+                d[f"{name}_per_second"] = self.counters[name] / seconds
+        if self.workers:
+            d["workers"] = { worker: m.asdict() for worker, m in self.workers.items() }
+        return d
+
+    def json(self, **kwargs):
+        import json
+        return json.dumps(self.asdict(), **kwargs)
+
+def encodeIds(ids):
+    # dictionary-encode object IDs: returns (codes, names), where codes are
+    # dense integers (uint32, or uint64 if there are more than 2**32
+    # distinct IDs) and names[codes] == ids. names is sorted, so codes
+    # sort in the same order as the IDs themselves.
+    #
+    # Sorting (and comparing) fixed-width strings is much slower than
+    # sorting integers, so string IDs are encoded once and everything
+    # downstream works on the codes. Integer IDs are returned as they are
+    # (with names=None).
+    if ids.dtype.kind in "iu":
+        return ids, None
+    names, codes = np.unique(ids, return_inverse=True)
+    codes = codes.reshape(-1).astype(np.uint32 if len(names) < 2**32 else np.uint64)
+    return codes, names
+
+@njit(parallel=True, cache=True)
+def _sortGroups(perm, offsets, mjd):
+    # stable-sort each group perm[offsets[k]:offsets[k+1]] by mjd, in place
+    for k in prange(len(offsets) - 1):
+        idx = perm[offsets[k]:offsets[k+1]]
+        perm[offsets[k]:offsets[k+1]] = idx[np.argsort(mjd[idx], kind="mergesort")]
+
+def groupBy(objectIds, mjd, parallel=False):
+    # group observations by object and sort them by time within each group.
+    #
+    # Returns: (ssObjects, perm, offsets), where perm is the permutation
+    #          that sorts the observations by (objectId, mjd), and the
+    #          observations of object ssObjects[k] are at
+    #          perm[offsets[k]:offsets[k+1]].
+    #
+    # (perm, offsets) is a CSR-style group-by index; it's just two flat
+    # arrays, so it can be stored and memory-mapped (see rundifi.py)
+    # rather than recomputed. This is the only sort linking needs: all
+    # downstream code (linkObject included) expects the observations of
+    # each object in this, time-sorted, order.
+    #
+    # String IDs are dictionary-encoded (see encodeIds) and the sort runs
+    # on the integer codes; ssObjects are the original IDs.
+    #
+    # parallel: rather than a (serial) lexsort, do a stable sort by
+    #           object, followed by sorting each object's observations by
+    #           time in a parallel kernel. The result is identical, and
+    #           much faster for large (a million rows or more) inputs. It
+    #           is opt-in, as it starts numba's thread pool, which isn't
+    #           worth it for small inputs.
+    codes, names = encodeIds(objectIds)
+    perm = np.argsort(codes, kind="stable") if parallel else np.lexsort((mjd, codes))
+    ids = codes[perm]
+    offsets = np.zeros(1, dtype=np.int64)
+    if len(ids):
+        offsets = np.concatenate(([0], (ids[1:] != ids[:-1]).nonzero()[0] + 1, [len(ids)]))
+    if parallel:
+        _sortGroups(perm, offsets, mjd)
+    ssObjects = ids[offsets[:-1]]
+    return (ssObjects if names is None else names[ssObjects]), perm, offsets
+
+def _groups(obsv, objectId, mjdTime, index=None):
+    # (ssObjects, perm, offsets) of the observations in obsv (see groupBy),
+    # using the precomputed (perm, offsets) index, if given.
+    if index is None:
+        return groupBy(obsv[objectId], obsv[mjdTime])
+    perm, offsets = index
+    return obsv[objectId][perm[offsets[:-1]]], perm, offsets
+
+def linkGroups(perm, offsets, mjd, ra, dec, diaSourceId, obj, seed=0, maxdt_minutes=90, minlen_arcsec=1., window=14, nlink=3, p=0.95, metrics=None):
+    # the batched equivalent of calling linkObject for every object; the
+    # inputs are full columns plus the (perm, offsets) group-by index, as
+    # returned by groupBy(). Fills the discovery columns of obj in place;
+    # obj["ssObjectId"] must already be set, as it keys the random numbers.
+    # If metrics (a Metrics instance) is given, the tracklet search and
+    # discovery stages are timed, and the objects and observations counted.
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.timer("tracklets"):
+        flags = trackletNights(perm, offsets, mjd, ra, dec, maxdt_minutes, minlen_arcsec)
+    with metrics.timer("discovery"):
+        _discover(flags, perm, offsets, mjd, diaSourceId, obj, objectKeys(obj["ssObjectId"]), seed, window, nlink, p)
+    metrics.count("objects", len(obj))
+    metrics.count("observations", offsets[-1] - offsets[0])
+    return obj
+
+def _discover(flags, perm, offsets, mjd, diaSourceId, obj, keys, seed, window, nlink, p):
+    # the discovery step of linkGroups: given the output of trackletNights
+    # (flags) and the objects' random number keys, (re)initialize and
+    # fill the discovery columns of obj.
+    initObjects(obj)
+    discoverBatch(*flags, perm, offsets, mjd, diaSourceId, seed, keys, window, nlink, p,
+                  obj["discoveryObservationId"], obj["discoverySubmissionDate"], obj["discoveryChances"])
+    return obj
+
+def kernelSignatures(perm, offsets, mjd, ra, dec, diaSourceId, obj, config=config):
+    # the (kernel name, numba signature) pairs linkGroups will compile when
+    # called with these arguments (the same as linkGroups takes).
+    #
+    # numba compiles a kernel on its first call with a new combination of
+    # argument types -- including array layout (columns of a structured
+    # array aren't contiguous) and writability (memory maps opened
+    # read-only) -- or loads it from its on-disk cache. The signatures are
+    # plain (picklable) numba types, so they can be compiled ahead of time,
+    # even in a different process (see compileKernels).
+    from numba import typeof, types
+    i8 = types.Array(types.int64, 1, "C")
+    flags = (i8, i8, types.Array(types.boolean, 1, "C"))
+    cols = tuple(typeof(a) for a in (perm, offsets, mjd))
+
+    sigs = [
+        ("trackletNights", (*cols, typeof(ra), typeof(dec), typeof(config["maxdt_minutes"]), typeof(config["minlen_arcsec"]))),
+        ("discoverBatch", (*flags, *cols, typeof(diaSourceId), typeof(config["seed"]), types.Array(types.uint64, 1, "C"),
+                           typeof(config["window"]), typeof(config["nlink"]), typeof(config["p"]),
+                           typeof(obj["discoveryObservationId"]), typeof(obj["discoverySubmissionDate"]), typeof(obj["discoveryChances"]))),
+    ]
+
+    # string IDs are hashed into random number keys (see objectKeys)
+    if obj.dtype["ssObjectId"].kind in "SU":
+        sigs += [ ("_hashIds", (types.Array(types.uint8 if obj.dtype["ssObjectId"].kind == "S" else types.uint32, 2, "C"),)) ]
+
+    return sigs
+
+def compileKernels(sigs):
+    # eagerly compile kernels for the given (name, signature) pairs (see
+    # kernelSignatures), without running them. With cache=True, the
+    # compiled code is also written to numba's on-disk cache, from where
+    # other processes can load it instead of compiling it again. Point
+    # NUMBA_CACHE_DIR to a writable (preferably node-local) directory if
+    # the package's __pycache__ isn't writable.
+    for name, sig in sigs:
+        globals()[name].compile(sig)
+
+def warmup(idDtype="u8", config=config):
+    # compile the batched kernels for the common input layouts: columns of
+    # a structured array (e.g., a memory-mapped diaSource.npy), and
+    # contiguous columns (dicts of arrays), each both writable and
+    # read-only (as are the columns of Arrow tables). With cache=True,
+    # this also fills the on-disk cache, so e.g. running it once after
+    # installation (or as a job's first step, "python -c 'import miniDifi;
+    # miniDifi.warmup()'") spares the later runs the compilation.
+
+    # (two rows, as numpy considers any one-element array contiguous)
+    obsv = np.zeros(2, dtype=[("ssObjectId", idDtype), ("diaSourceId", "u8"), ("midPointTai", "f8"), ("ra", "f8"), ("decl", "f8")])
+    obj = np.zeros(2, dtype=objectDtype(obsv.dtype["ssObjectId"]))
+    perm, offsets = np.arange(2), np.array([0, 1, 2])
+
+    ro = obsv.copy()
+    ro.flags.writeable = False
+    contiguous = { name: np.ascontiguousarray(obsv[name]) for name in obsv.dtype.names }
+    contiguousRo = { name: col.copy() for name, col in contiguous.items() }
+    for col in contiguousRo.values():
+        col.flags.writeable = False
+    for cols in [obsv, ro, contiguous, contiguousRo]:
+        compileKernels(kernelSignatures(perm, offsets, cols["midPointTai"], cols["ra"], cols["decl"], cols["diaSourceId"], obj, config))
+
+def _arrowToNumpy(col):
+    # an Arrow (chunked) array as an ndarray. String and binary columns
+    # (e.g., string object IDs) become fixed-width bytes ("S") arrays, as
+    # the kernels and writers can't handle arrays of Python objects.
+    import pyarrow as pa
+    arr = col.to_numpy(zero_copy_only=False)
+    if pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+        arr = np.char.encode(arr.astype("U"), "utf-8")
+    elif pa.types.is_binary(col.type) or pa.types.is_large_binary(col.type):
+        arr = arr.astype("S")
+    return arr
+
+def asColumns(obsv, names=None):
+    # return the named columns (default: all) of obsv in a form that can be indexed by
+    # column name and gives ndarrays. Structured ndarrays and dicts of
+    # ndarrays are returned as they are; pyarrow Tables, RecordBatches and
+    # streams of RecordBatches (e.g., a RecordBatchReader) are converted
+    # to a dict of ndarrays. Numeric columns without nulls, stored in a
+    # single chunk, are converted without copying; chunked columns (e.g.,
+    # when reading a stream) have to be concatenated. String columns are
+    # converted to fixed-width bytes (see _arrowToNumpy).
+    if isinstance(obsv, (np.ndarray, dict)):
+        return obsv
+
+    import pyarrow as pa
+    if isinstance(obsv, pa.RecordBatch):
+        return { name: _arrowToNumpy(obsv.column(name)) for name in names or obsv.schema.names }
+    if not isinstance(obsv, pa.Table):
+        obsv = pa.Table.from_batches(list(obsv))
+
+    cols = {}
+    names = names or obsv.schema.names
+    for name in names:
+        col = obsv.column(name)
+        col = col.chunk(0) if col.num_chunks == 1 else col.combine_chunks()
+        cols[name] = _arrowToNumpy(col)
+    return cols
+
+def linkObservations(obsv, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl", engine="batched", index=None, names=None, metrics=None):
+    # expects a ndarray of observations (or a dict of columns, or a pyarrow
+    # Table or stream of RecordBatches, see asColumns()), with the following
+    # columns:
     #
     #  - objectId: a unique ID of the solar system object
     #  - sourceId: a unique ID of the observation
@@ -172,6 +774,21 @@ def linkObservations(obsv, objectId="ssObjectId", sourceId="diaSourceId", mjdTim
     #
     # The names of these columns can be overridden with optional arguments
     #
+    # engine: "batched" links all objects in a single parallel numba kernel,
+    #         "object" calls linkObject for one object at a time (this is the
+    #         slow reference implementation).
+    #
+    # index:  an optional precomputed (perm, offsets) group-by index, as
+    #         returned by groupBy(); computed if not given.
+    #
+    # names:  if the objectId column holds codes returned by encodeIds()
+    #         (rather than the IDs themselves), the matching table of
+    #         names. The output (and the random number streams) will then
+    #         refer to the original IDs.
+    #
+    # metrics: an optional Metrics instance, to collect the timings of the
+    #         individual stages and the objects/observations rates into.
+    #
     # output: an ndarray with one row per /detected/ object, containing the
     #         following columns:
     #
@@ -183,53 +800,728 @@ def linkObservations(obsv, objectId="ssObjectId", sourceId="diaSourceId", mjdTim
 
     # group-by
     import time
+    metrics = Metrics() if metrics is None else metrics
     start = time.perf_counter()
-    # create the "group by" splits for individual objects 
-    # See https://stackoverflow.com/a/43094244 for inspiration for this code
-    i = np.argsort(obsv[objectId], kind='stable')
-    ssObjects, idx = np.unique(obsv[objectId][i], return_index=True)
-    splits = np.split(i, idx[1:])
+    obsv = asColumns(obsv, [objectId, sourceId, mjdTime, ra, dec])
+
+    # create the "group by" index for individual objects
+    ssObjects, i, offsets = _groups(obsv, objectId, mjdTime, index)
+    if names is not None:
+        ssObjects = names[ssObjects]
     print(f"{len(ssObjects)=}")
 
     end = time.perf_counter()
+    metrics.add("groupby", end-start)
     print(f"Group-by time: {end-start:.3f} seconds")
 
     # "link"
     # pre-initialize output columns
-    obj = np.zeros(len(splits), dtype=np.dtype([
-        ("ssObjectId", obsv[objectId].dtype),
-        ("discoveryObservationId", "u8"),
-        ("discoverySubmissionDate", "f8"),
-        ("discoveryChances", "i4")
-    ]))
+    obj = np.zeros(len(ssObjects), dtype=objectDtype(ssObjects.dtype))
+    obj["ssObjectId"] = ssObjects
 
-    # linking test for each object
-    for k, obsv_indices in enumerate(splits):
-        # extract the observations of this object into a ndarray of expected
-        # format and column names
-        thisObsv = obsv[[sourceId, mjdTime, ra, dec]][obsv_indices]
-        thisObsv.dtype.names = ["diaSourceId", "midPointTai", "ra", "decl"]
+    if engine == "batched":
+        # link everything in one go, reading the columns through the index
+        linkGroups(i, offsets, obsv[mjdTime], obsv[ra], obsv[dec], obsv[sourceId], obj, **config, metrics=metrics)
+    elif engine == "object":
+        # extract the observations into a ndarray of expected format and
+        # column names, in group-by order
+        allObsv = np.empty(len(i), dtype=[("diaSourceId", "u8"), ("midPointTai", "f8"), ("ra", "f8"), ("decl", "f8")])
+        for name, col in zip(allObsv.dtype.names, [sourceId, mjdTime, ra, dec]):
+            allObsv[name] = obsv[col][i]
 
-        obj[k] = (ssObjects[k], *linkObject(thisObsv, **config))
+        # linking test for each object
+        keys = objectKeys(ssObjects)
+        for k in range(len(obj)):
+            thisObsv = allObsv[offsets[k]:offsets[k+1]]
+            obj[k] = (ssObjects[k], *linkObject(thisObsv, key=keys[k], **config, metrics=metrics))
+        metrics.count("objects", len(obj))
+        metrics.count("observations", len(i))
+    else:
+        raise Exception(f"Unknown engine {engine}")
 
     print(obj["discoveryObservationId"])
 
     end = time.perf_counter()
+    metrics.add("total", end-start)
     print(f"Total linking time: {end-start:.3f} seconds")
 
     return obj
 
-###########################################################
+def findTracklets(obsv, objectId="ssObjectId", mjdTime="midPointTai", ra="ra", dec="decl", maxPerNight=0, index=None, buf=None, config=config):
+    # find the tracklets (the pairs of observations that satisfy the
+    # tracklet criteria of config) of all objects, all of them or the first
+    # maxPerNight on each night. buf is an optional preallocated (n, 2)
+    # int64 array to collect the pairs into; it's grown as needed.
+    #
+    # Returns: (ssObjects, pairOffsets, pairs), where the tracklets of
+    #          ssObjects[k] are pairs[pairOffsets[k]:pairOffsets[k+1]], as
+    #          (earlier, later) row indices into obsv (so, e.g., their
+    #          sourceIds are obsv[sourceId][pairs]).
+    obsv = asColumns(obsv, [objectId, mjdTime, ra, dec])
+    ssObjects, i, offsets = _groups(obsv, objectId, mjdTime, index)
+    if buf is None:
+        buf = np.empty((max(len(i) // 4, 16), 2), dtype=np.int64)
 
-config = dict(
-    seed=0,
+    pairOffsets, buf, n = trackletPairs(i, offsets, obsv[mjdTime], obsv[ra], obsv[dec],
+                                        config["maxdt_minutes"], config["minlen_arcsec"], maxPerNight, buf)
+    return ssObjects, pairOffsets, buf[:n]
 
-    maxdt_minutes=90,
-    minlen_arcsec=1.,
-    window=14,
-    nlink=3,
-    p=0.95
-)
+def partitionObservations(obj, index, obsv=None, out=None):
+    # split the observations into those of objects that were found and
+    # those of objects that were missed, given the linking results (obj)
+    # and the group-by index (perm, offsets) they were computed with (so
+    # that obj[k] is the object whose observations are at
+    # perm[offsets[k]:offsets[k+1]]).
+    #
+    # The per-object found flag is expanded over each group and scattered
+    # back through perm, so this is O(n), with no hashing or sorting.
+    #
+    # Returns: (found, missed) -- indices of the found/missed observations,
+    #          in their original order. If obsv is given, the observations
+    #          themselves are returned instead; if out=(foundOut, missedOut)
+    #          is also given (e.g., two memory-mapped arrays of the right
+    #          lengths), they're written into these.
+    perm, offsets = index
+    isFound = np.empty(len(perm), dtype=bool)
+    isFound[perm] = np.repeat(~np.isnan(obj["discoverySubmissionDate"]), np.diff(offsets))
+    found, missed = isFound.nonzero()[0], (~isFound).nonzero()[0]
+
+    if obsv is None:
+        return found, missed
+    if out is None:
+        return obsv[found], obsv[missed]
+    assert len(out[0]) == len(found) and len(out[1]) == len(missed), "output arrays are of wrong size"
+    np.take(obsv, found, out=out[0])
+    np.take(obsv, missed, out=out[1])
+    return out
+
+def configGrid(**params):
+    # the list of configurations for all combinations of the given
+    # parameter values, with the rest taken from the default config.
+    #
+    # Example:
+    #   > configGrid(window=[7, 14], nlink=[2, 3])
+    #
+    #   [{..., 'window': 7, 'nlink': 2, ...}, {..., 'window': 7, 'nlink': 3, ...}, ...]
+    #
+    from itertools import product
+    names = list(params)
+    return [ {**config, **dict(zip(names, values))} for values in product(*params.values()) ]
+
+def linkSweep(obsv, configs, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl", index=None):
+    # link the observations for every configuration in configs (a list of
+    # dicts with the same keys as config; missing keys take the default
+    # values), and return a list with the result table of each.
+    #
+    # This is much cheaper than calling linkObservations for each
+    # configuration: the group-by is done once, the per-night tracklet
+    # flags are computed once per distinct (maxdt_minutes, minlen_arcsec)
+    # pair, and only the discovery step is rerun for each configuration.
+    configs = [ {**config, **cfg} for cfg in configs ]
+    obsv = asColumns(obsv, [objectId, sourceId, mjdTime, ra, dec])
+
+    ssObjects, i, offsets = _groups(obsv, objectId, mjdTime, index)
+    mjd, ras, decs, diaSourceId = obsv[mjdTime], obsv[ra], obsv[dec], obsv[sourceId]
+    keys = objectKeys(ssObjects)
+
+    # group the configurations by their tracklet criteria, so that only
+    # one set of flags needs to be kept around at any time
+    criteria = {}
+    for k, cfg in enumerate(configs):
+        criteria.setdefault((cfg["maxdt_minutes"], cfg["minlen_arcsec"]), []).append(k)
+
+    results = [ None ] * len(configs)
+    for (maxdt_minutes, minlen_arcsec), ks in criteria.items():
+        flags = trackletNights(i, offsets, mjd, ras, decs, maxdt_minutes, minlen_arcsec)
+        for k in ks:
+            cfg = configs[k]
+            obj = np.zeros(len(ssObjects), dtype=objectDtype(ssObjects.dtype))
+            obj["ssObjectId"] = ssObjects
+            results[k] = _discover(flags, i, offsets, mjd, diaSourceId, obj, keys, cfg["seed"], cfg["window"], cfg["nlink"], cfg["p"])
+
+    return results
+
+@njit(parallel=True, cache=True)
+def discoverRealizations(nightOffsets, nights, hasTrk, seed, keys, window, nlink, p, nreal):
+    # draw <nreal> realizations of the discovery step for all objects, given
+    # the output of trackletNights. The discovery opportunities don't depend
+    # on the realization, so they're computed once per object; realization r
+    # then draws from stream 1 + r of the object's generator (realization 0
+    # is therefore the same as a regular run with this seed).
+    #
+    # Returns: (nfound, chances, oppNights, oppFirst), where nfound[k] is the
+    #          number of realizations in which object k was discovered,
+    #          chances[k] the number of its discovery opportunities, and
+    #          oppNights/oppFirst hold the opportunity nights and the number
+    #          of realizations in which each was the first discovery. The
+    #          latter two are laid out like nights (i.e., indexed by
+    #          nightOffsets, since there are never more opportunities than
+    #          nights with observations), with the first chances[k] entries
+    #          of each object used.
+    nobj = len(nightOffsets) - 1
+    nfound = np.zeros(nobj, dtype=np.int64)
+    chances = np.zeros(nobj, dtype=np.int64)
+    oppNights = np.full(len(nights), -1, dtype=np.int64)
+    oppFirst = np.zeros(len(nights), dtype=np.int64)
+
+    for k in prange(nobj):
+        nb, ne = nightOffsets[k], nightOffsets[k+1]
+        if nb == ne:
+            continue
+
+        disc = uniqueOpportunities(nights[nb:ne], hasTrk[nb:ne], window, nlink, seed, keys[k])
+        chances[k] = len(disc)
+        oppNights[nb:nb+len(disc)] = disc
+
+        for r in range(nreal):
+            for j in range(len(disc)):
+                if uniform(seed, keys[k], 1 + r, j) < p:
+                    oppFirst[nb + j] += 1
+                    nfound[k] += 1
+                    break
+
+    return nfound, chances, oppNights, oppFirst
+
+def linkRealizations(obsv, nreal, objectId="ssObjectId", mjdTime="midPointTai", ra="ra", dec="decl", index=None, config=config):
+    # Monte Carlo mode: link the observations once, and draw <nreal>
+    # realizations of the (random) discovery step for every object. This
+    # costs about as much as a single linkObservations run.
+    #
+    # Returns: (obj, (offsets, nights, counts)), where obj has one row per
+    #          object with the following columns:
+    #
+    #  - ssObjectId:               the objectId of this object
+    #  - discoveryProbability:     the fraction of realizations in which the object was discovered
+    #  - meanDiscoverySubmissionDate: the mean first-discovery night, over the realizations where it was discovered
+    #  - discoveryChances:         the number of discovery opportunities
+    #  - expectedDiscoveryChances: the expected value of discoveryChances as
+    #                              reported by linkObservations (which is zero
+    #                              for undiscovered objects)
+    #
+    #   and nights[offsets[k]:offsets[k+1]] are the discovery opportunities of
+    #   object k, with counts[...] the number of realizations in which each
+    #   one was the first discovery (i.e., the distribution of the
+    #   first-discovery night).
+    obsv = asColumns(obsv, [objectId, mjdTime, ra, dec])
+    ssObjects, i, offsets = _groups(obsv, objectId, mjdTime, index)
+
+    nightOffsets, nights, hasTrk = trackletNights(i, offsets, obsv[mjdTime], obsv[ra], obsv[dec],
+                                                  config["maxdt_minutes"], config["minlen_arcsec"])
+    nfound, chances, oppNights, oppFirst = discoverRealizations(nightOffsets, nights, hasTrk, config["seed"], objectKeys(ssObjects),
+                                                                config["window"], config["nlink"], config["p"], nreal)
+
+    # compact the distribution of first-discovery nights to the opportunities
+    # that exist (the first chances[k] entries of each object)
+    used = np.arange(len(nights)) - np.repeat(nightOffsets[:-1], np.diff(nightOffsets)) < np.repeat(chances, np.diff(nightOffsets))
+    distOffsets = np.zeros(len(chances) + 1, dtype=np.int64)
+    np.cumsum(chances, out=distOffsets[1:])
+    oppNights, oppFirst = oppNights[used], oppFirst[used]
+
+    obj = np.zeros(len(ssObjects), dtype=np.dtype([
+        ("ssObjectId", ssObjects.dtype),
+        ("discoveryProbability", "f8"),
+        ("meanDiscoverySubmissionDate", "f8"),
+        ("discoveryChances", "i4"),
+        ("expectedDiscoveryChances", "f8")
+    ]))
+    obj["ssObjectId"] = ssObjects
+    obj["discoveryProbability"] = nfound / nreal
+    nightSum = np.bincount(np.repeat(np.arange(len(obj)), chances), weights=oppNights*oppFirst, minlength=len(obj))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        obj["meanDiscoverySubmissionDate"] = np.where(nfound > 0, nightSum / nfound, np.nan)
+    obj["discoveryChances"] = chances
+    obj["expectedDiscoveryChances"] = obj["discoveryProbability"] * chances
+
+    return obj, (distOffsets, oppNights, oppFirst)
+
+#
+# Incremental (nightly) linking
+#
+# Rather than relinking every object from its full history, keep a small
+# state per object and update it as each night of observations comes in.
+# The state relies on this property of uniqueOpportunities: a night is a
+# unique discovery opportunity iff it's a night with observations on which
+# the trailing window has at least <nlink> tracklets (the random sums only
+# change on nights with observations). So all that needs to be kept is:
+#
+#   - lastNight:  the last night the object was observed
+#   - trkMask:    a bitmask of the tracklet nights in the trailing window
+#                 (bit b set <=> night lastNight-b had a tracklet)
+#   - nchances:   the number of discovery opportunities so far, which is
+#                 also the index of the next discovery draw (stream 1)
+#   - discovery*: the discovery status, as output by linkObservations
+#
+# Because each opportunity's draw depends only on its index (see uniform()),
+# the results match a full recompute over all nights seen so far.
+#
+
+def stateDtype(idDtype):
+    # the dtype of the per-object incremental linking state
+    return np.dtype([
+        ("ssObjectId", idDtype),
+        ("lastNight", "i8"),
+        ("trkMask", "u8"),
+        ("nchances", "i4"),
+        ("discoveryObservationId", "u8"),
+        ("discoverySubmissionDate", "f8"),
+    ])
+
+@njit(cache=True)
+def _popcount(x):
+    n = 0
+    while x:
+        x &= x - np.uint64(1)
+        n += 1
+    return n
+
+@njit(parallel=True, cache=True)
+def updateObjects(rows, offsets, mjd, ra, dec, diaSourceId, keys, lastNight, trkMask, nchances,
+                  discoveryObservationId, discoverySubmissionDate, seed, maxdt_minutes, minlen_arcsec, window, nlink, p):
+    # advance the state of objects rows[k] with their new observations at
+    # [offsets[k], offsets[k+1]) of mjd/ra/dec/diaSourceId, SORTED BY
+    # OBSERVATION TIME (!), all on nights after lastNight[rows[k]]. keys[k]
+    # is the random number stream key of the k-th object.
+    wmask = (np.uint64(1) << np.uint64(window)) - np.uint64(1) if window < 64 else ~np.uint64(0)
+    for k in prange(len(rows)):
+        s = rows[k]
+        b, e = offsets[k], offsets[k+1]
+        night = mjd[b:e].astype(np.int64)  ## FIXME: works only for LSST
+        nights, hasTrk = trackletsInNightsXYZ(night, mjd[b:e], unitVectors(ra[b:e], dec[b:e]), maxdt_minutes, minlen_arcsec)
+
+        for n in range(len(nights)):
+            # slide the window to this night, and add its tracklet (if any)
+            shift = nights[n] - lastNight[s]
+            mask = trkMask[s] << np.uint64(shift) if lastNight[s] >= 0 and shift < 64 else np.uint64(0)
+            trkMask[s] = mask | np.uint64(hasTrk[n])
+            lastNight[s] = nights[n]
+
+            if _popcount(trkMask[s] & wmask) < nlink:
+                continue
+
+            # a discovery opportunity; draw for it if not yet discovered
+            j = nchances[s]
+            nchances[s] += 1
+            if np.isnan(discoverySubmissionDate[s]) and uniform(seed, keys[k], 1, j) < p:
+                discoverySubmissionDate[s] = nights[n]
+                discoveryObservationId[s] = diaSourceId[b + np.searchsorted(mjd[b:e], nights[n])]
+
+class IncrementalLinker:
+    # Links observations as they arrive, night by night. Each call to
+    # update() must bring observations from nights after the last night
+    # seen for each object (e.g., the diaSources of the night that just
+    # ended); only the objects observed in it are updated.
+    #
+    # Example:
+    #   > linker = IncrementalLinker()
+    #   > for obsv in nights:
+    #   >     linker.update(obsv)
+    #   > obj = linker.results()   # same as linkObservations(all nights)
+    #   > linker.save("state.npz")
+
+    def __init__(self, config=config, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl", state=None):
+        self.config = {**config}
+        self.objectId, self.sourceId, self.mjdTime, self.ra, self.dec = objectId, sourceId, mjdTime, ra, dec
+        self.state = state
+        assert self.config["window"] <= 64, "The incremental linker supports windows of up to 64 nights"
+
+    def update(self, obsv):
+        # add new observations, returning the indices (into the state) of
+        # the objects that were updated
+        obsv = asColumns(obsv, [self.objectId, self.sourceId, self.mjdTime, self.ra, self.dec])
+        ssObjects, i, offsets = groupBy(obsv[self.objectId], obsv[self.mjdTime])
+
+        # add rows for objects we haven't seen before, keeping the state
+        # sorted by ssObjectId
+        if self.state is None:
+            self.state = np.zeros(0, dtype=stateDtype(ssObjects.dtype))
+        idDtype = self.state.dtype["ssObjectId"]
+        if not np.can_cast(ssObjects.dtype, idDtype, "safe"):
+            # IDs wider than the ones seen so far (e.g., a longer string
+            # ID): widen the state, so that they're not truncated
+            assert np.can_cast(idDtype, ssObjects.dtype, "safe"), f"Object IDs of type {ssObjects.dtype} don't match the state ({idDtype})"
+            self.state = self.state.astype(stateDtype(ssObjects.dtype))
+        ssObjects = ssObjects.astype(self.state.dtype["ssObjectId"], copy=False)
+        known = self.state["ssObjectId"]
+        pos = np.searchsorted(known, ssObjects)
+        new = (pos == len(known)) | (known[np.minimum(pos, len(known) - 1)] != ssObjects) if len(known) else np.ones(len(ssObjects), dtype=bool)
+        if new.any():
+            rows = np.zeros(new.sum(), dtype=self.state.dtype)
+            rows["ssObjectId"] = ssObjects[new]
+            rows["lastNight"] = -1
+            rows["discoveryObservationId"] = 0xFFFF_FFFF_FFFF_FFFF
+            rows["discoverySubmissionDate"] = np.nan
+            self.state = np.insert(self.state, pos[new], rows)
+        rows = np.searchsorted(self.state["ssObjectId"], ssObjects)
+
+        mjd = obsv[self.mjdTime][i]
+        firstNight = mjd[offsets[:-1]].astype(np.int64)
+        assert np.all(firstNight > self.state["lastNight"][rows]), "New observations must come from nights after the ones already seen"
+
+        cfg = self.config
+        lastNight, trkMask, nchances = self.state["lastNight"], self.state["trkMask"], self.state["nchances"]
+        discoveryObservationId, discoverySubmissionDate = self.state["discoveryObservationId"], self.state["discoverySubmissionDate"]
+        updateObjects(rows, offsets, mjd, obsv[self.ra][i], obsv[self.dec][i], obsv[self.sourceId][i], objectKeys(ssObjects),
+                      lastNight, trkMask, nchances, discoveryObservationId, discoverySubmissionDate,
+                      cfg["seed"], cfg["maxdt_minutes"], cfg["minlen_arcsec"], cfg["window"], cfg["nlink"], cfg["p"])
+        return rows
+
+    def results(self):
+        # the linking results so far, in the format of linkObservations
+        obj = np.zeros(len(self.state), dtype=objectDtype(self.state.dtype["ssObjectId"]))
+        for name in ["ssObjectId", "discoveryObservationId", "discoverySubmissionDate"]:
+            obj[name] = self.state[name]
+        obj["discoveryChances"] = np.where(np.isnan(obj["discoverySubmissionDate"]), 0, self.state["nchances"])
+        return obj
+
+    def save(self, fn):
+        import json
+        np.savez(fn, state=self.state, config=json.dumps(self.config))
+
+    @classmethod
+    def load(cls, fn, **kwargs):
+        import json
+        with np.load(fn) as data:
+            return cls(config=json.loads(str(data["config"])), state=data["state"], **kwargs)
+
+#
+# Streaming (out-of-core) linking
+#
+# For catalogs that don't fit in memory: observations are read in chunks,
+# regrouped so that no object is split between two chunks, linked chunk by
+# chunk, and the results appended to an output writer. Peak memory use is
+# set by the chunk size, not the size of the survey.
+#
+# Chunks are dicts of {column name: ndarray}, which linking code can index
+# just like a structured ndarray.
+#
+
+def readChunks(source, chunksize=10_000_000, columns=None):
+    # iterate over chunks of (up to) chunksize rows of a .npy file (which
+    # is memory-mapped, so only the rows being read are paged in; legacy
+    # raw files with a .dtype sidecar work too, see
+    # rundifi.openOrCreateArray) or a Parquet file or dataset directory.
+    if source.endswith(".npy"):
+        import os
+        from rundifi import openOrCreateArray
+        arr, _, fd = openOrCreateArray(source)
+        os.close(fd)
+        names = arr.dtype.names if columns is None else columns
+        for b in range(0, len(arr), chunksize):
+            chunk = arr[b:b+chunksize]
+            yield { name: np.asarray(chunk[name]) for name in names }
+    else:
+        import pyarrow.dataset as ds
+        for batch in ds.dataset(source, format="parquet").to_batches(columns=columns, batch_size=chunksize):
+            yield asColumns(batch)
+
+def objectChunks(chunks, objectId="ssObjectId"):
+    # regroup a stream of chunks of observations (dicts of columns,
+    # structured ndarrays, or pyarrow RecordBatches) clustered by object
+    # (e.g., sorted by (objectId, time)) so that all observations of any one object
+    # are in the same chunk. The trailing rows of each chunk, which may
+    # continue into the next one, are carried over.
+    carry = None
+    for chunk in chunks:
+        chunk = asColumns(chunk)
+        if isinstance(chunk, np.ndarray):
+            chunk = { name: chunk[name] for name in chunk.dtype.names }
+        if carry is not None:
+            chunk = { name: np.concatenate((carry[name], col)) for name, col in chunk.items() }
+        ids = chunk[objectId]
+        if len(ids) == 0:
+            continue
+
+        # where the run of the last object begins
+        cut = (ids != ids[-1]).nonzero()[0]
+        cut = cut[-1] + 1 if len(cut) else 0
+
+        if cut:
+            yield { name: col[:cut] for name, col in chunk.items() }
+        carry = { name: col[cut:] for name, col in chunk.items() }
+
+    if carry is not None and len(carry[objectId]):
+        yield carry
+
+class NpyWriter:
+    # Appends structured arrays to a .npy file, whose header is (re)written
+    # with the final number of rows on close(). The header is written with
+    # room for the largest possible row count up front, so the data never
+    # has to move.
+    #
+    # Arrays of a narrower, but otherwise identical, dtype (e.g. S8 rather
+    # than S9 object IDs, as string IDs read from Parquet are only as wide
+    # as the longest one in the chunk) are converted on write.
+
+    def __init__(self, fn, dtype):
+        self.fn, self.dtype, self.nrows = fn, np.dtype(dtype), 0
+        assert not self.dtype.hasobject, f"Can't write Python objects to a .npy file (dtype {self.dtype})"
+        self.fp = open(fn, "wb")
+        self.fp.write(self._header(2**63 - 1))
+        self.hlen = self.fp.tell()
+
+    def _header(self, nrows):
+        from numpy.lib import format
+        d = { "descr": format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (nrows,) }
+        h = repr(d).encode("latin1")
+        h += b" " * (-(len(h) + 11) % 64) + b"\n"
+        return format.MAGIC_PREFIX + bytes([1, 0]) + len(h).to_bytes(2, "little") + h
+
+    def write(self, arr):
+        if arr.dtype != self.dtype:
+            assert arr.dtype.names == self.dtype.names and np.can_cast(arr.dtype, self.dtype, "safe"), f"Expected dtype {self.dtype}, got {arr.dtype}"
+            arr = arr.astype(self.dtype)
+        self.fp.write(np.ascontiguousarray(arr).tobytes())
+        self.nrows += len(arr)
+
+    def close(self):
+        h = self._header(self.nrows)
+        h = h[:-1].ljust(self.hlen - 1) + b"\n"
+        self.fp.seek(0)
+        self.fp.write(h[:8] + (len(h) - 10).to_bytes(2, "little") + h[10:])
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ParquetWriter:
+    # Appends structured arrays to a Parquet file, one row group per write().
+    # The schema is taken from the first array written.
+
+    def __init__(self, fn):
+        self.fn, self.writer = fn, None
+
+    def write(self, arr):
+        import pyarrow as pa, pyarrow.parquet as pq
+        table = pa.table({ name: arr[name] for name in arr.dtype.names })
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.fn, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def linkStream(chunks, writer, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl", config=config, metrics=None):
+    # link a stream of chunks of observations (e.g., from readChunks()),
+    # clustered by object, writing the results to writer (any object with a
+    # write(obj) method, e.g. NpyWriter or ParquetWriter). Stage timings
+    # are collected into metrics, if given.
+    #
+    # Returns: the number of objects linked
+    metrics = Metrics() if metrics is None else metrics
+    nobj = 0
+    for chunk in objectChunks(chunks, objectId):
+        with metrics.timer("groupby"):
+            ssObjects, i, offsets = groupBy(chunk[objectId], chunk[mjdTime])
+        obj = np.zeros(len(ssObjects), dtype=objectDtype(chunk[objectId].dtype))
+        obj["ssObjectId"] = ssObjects
+        linkGroups(i, offsets, chunk[mjdTime], chunk[ra], chunk[dec], chunk[sourceId], obj, **config, metrics=metrics)
+
+        with metrics.timer("output"):
+            writer.write(obj)
+        metrics.count("chunks")
+        nobj += len(obj)
+
+    return nobj
+
+# the state of the process linking the chunks (see _link_chunk): the
+# linker, the (memory-mapped) input and output arrays, and the chunk size.
+# It is set by MockLinker.link_all, or by _init_worker in worker processes.
+_shared = None
+
+def _fileSpec(arr, writable=False):
+    # (filename, dtype, nrows, offset, mode) with which other processes can
+    # open arr (see _openSpec), if it's a whole memory-mapped file (e.g.,
+    # from rundifi.openOrCreateArray, or np.load(..., mmap_mode="r")) they
+    # can share; otherwise None.
+    import mmap
+    if not isinstance(arr, np.memmap) or not isinstance(arr.base, mmap.mmap) or arr.filename is None or arr.ndim != 1:
+        return None
+    if writable and arr.mode not in ("r+", "w+"):
+        return None
+    return arr.filename, arr.dtype, len(arr), arr.offset, ("r+" if writable else "r")
+
+def _openSpec(spec):
+    filename, dtype, nrows, offset, mode = spec
+    return np.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=(nrows,))
+
+def _shareable(arr, fn, writable=False):
+    # the _fileSpec of arr, copying it into (a new) file fn first if it
+    # isn't a file other processes can open. Returns (spec, copied).
+    spec = _fileSpec(arr, writable)
+    if spec is not None:
+        return spec, False
+    copy = np.lib.format.open_memmap(fn, mode="w+", dtype=arr.dtype, shape=arr.shape)
+    copy[:] = arr
+    return _fileSpec(copy, writable), True
+
+def _init_worker(linker, specs, chunksize):
+    # open the arrays link_all shared with the worker processes; the
+    # parallelism comes from the processes, so don't oversubscribe the cores
+    global _shared
+    import numba
+    numba.set_num_threads(1)
+    dia, perm, offsets, obj, done = [ _openSpec(spec) if spec is not None else None for spec in specs ]
+    _shared = (linker, dia, (perm, offsets), obj, done, chunksize)
+
+def _link_chunk(c):
+    # returns the number of objects linked, and the chunk's metrics
+    import os
+    linker, dia, index, obj, done, chunksize = _shared
+    k0 = c*chunksize
+    k1 = min(k0 + chunksize, len(obj))
+    metrics = Metrics()
+    linker.link_chunk(dia, index, obj, k0, k1, metrics=metrics)
+    if done is not None:
+        done[k0:k1] = 1
+    metrics.count("chunks")
+    return k1 - k0, os.getpid(), metrics.asdict()
+
+def _chunkIndex(index, k0, k1):
+    # the group-by index of objects [k0, k1): their (time-sorted)
+    # observations are the contiguous slice perm[offsets[k0]:offsets[k1]],
+    # with offsets into it. Note the offsets are computed (so writable),
+    # even when index is a read-only memory map.
+    perm, offsets = index
+    return perm[offsets[k0]:offsets[k1]], offsets[k0:k1+1] - offsets[k0]
+
+class MockLinker:
+    # A linking engine for catalogs too big to fit the per-process memory
+    # (or patience) budget. Given the observations (typically a memory-mapped
+    # diaSource.npy) and the (perm, offsets) group-by index (see groupBy), it
+    # links the objects in chunks of <chunksize> objects, in <nworkers>
+    # worker processes.
+    #
+    # The workers are started fresh (by a fork server), rather than forked
+    # from the calling process: a process that has run numba's parallel
+    # kernels mustn't fork (with the TBB threading layer, it then hangs at
+    # exit), and this way link_all works no matter what ran before it.
+    # So rather than inheriting the arrays, the workers open them by file
+    # name. The observations, the index and the output are typically
+    # memory-mapped files already (e.g., opened with
+    # rundifi.openOrCreateArray, or np.load(..., mmap_mode="r")), and are
+    # shared as they are; arrays in memory are first copied into scratch
+    # files (in /dev/shm, if there is one). The workers read the
+    # observations directly from the (shared) memory map and write the
+    # results straight into the output file. (As with any processes that
+    # aren't forked, the workers import the calling script, so scripts
+    # linking with nworkers > 1 need an 'if __name__ == "__main__":' guard.)
+    #
+    # Chunks are handed out dynamically, and because every object is
+    # linked independently of the others, the results don't depend on the
+    # number of workers or the order in which the chunks were processed.
+    #
+    # For resumable runs, pass a (memory-mapped) journal array of
+    # one uint8 per object as done; objects are flagged there once their
+    # results have been written, and chunks whose objects are all flagged
+    # are skipped. A restarted run (with any chunksize) then picks up
+    # where the previous one left off. One byte (rather than one bit) per
+    # object keeps the concurrent writes of different workers independent.
+
+    def __init__(self, config, objectId="ssObjectId", sourceId="diaSourceId", mjdTime="midPointTai", ra="ra", dec="decl"):
+        self.config = config
+        self.objectId, self.sourceId, self.mjdTime, self.ra, self.dec = objectId, sourceId, mjdTime, ra, dec
+
+    def link_chunk(self, dia, index, obj, k0, k1, metrics=None):
+        # link objects [k0, k1), writing the results into obj[k0:k1].
+        # The observations of these objects are a single contiguous
+        # (already time-sorted) slice of the index permutation (see
+        # _chunkIndex), and are read straight from the (memory-mapped)
+        # columns of dia.
+        i, offsets = _chunkIndex(index, k0, k1)
+
+        out = obj[k0:k1]
+        out["ssObjectId"] = dia[self.objectId][i[offsets[:-1]]]
+        linkGroups(i, offsets, dia[self.mjdTime], dia[self.ra], dia[self.dec], dia[self.sourceId], out, **self.config, metrics=metrics)
+
+    def link_all(self, dia, index, chunksize=1000, tqdm=None, nworkers=1, obj=None, done=None, metrics=None):
+        # link all objects, returning the output array (obj, if given). If
+        # metrics (a Metrics instance) is given, the stage timings and
+        # counts of all chunks are merged into it, with a per-worker
+        # breakdown. The per-chunk stages are summed over all workers; the
+        # wall-clock time of the run is recorded as the "link" stage.
+        global _shared
+        import os
+        metrics = Metrics() if metrics is None else metrics
+
+        perm, offsets = index
+        nobj = len(offsets) - 1
+        out = np.zeros(nobj, dtype=objectDtype(dia.dtype[self.objectId])) if obj is None else obj
+        assert len(out) == nobj, f"The output array has {len(out)} rows, expected {nobj}"
+
+        nchunks = (nobj + chunksize - 1) // chunksize
+        chunks = range(nchunks)
+        if done is not None:
+            assert len(done) == nobj, f"The journal has {len(done)} rows, expected {nobj}"
+            assert obj is not None, "Resuming requires an output array"
+            chunks = [ c for c in chunks if not done[c*chunksize:(c+1)*chunksize].all() ]
+        progress = tqdm(total=nobj) if tqdm is not None else None
+        if progress is not None and done is not None:
+            progress.update(nobj - sum(min(chunksize, nobj - c*chunksize) for c in chunks))
+
+        def compile(dia, index, out):
+            # compile the kernels for these inputs up front, leaving the
+            # compiled code in numba's cache, from where each worker loads
+            # it in a fraction of the time it'd take to compile. The
+            # signatures must be those of the arguments link_chunk passes --
+            # the chunk's index, not the (possibly read-only) stored one --
+            # or every worker would miss the cache and compile the kernels
+            # itself.
+            sigs = kernelSignatures(*_chunkIndex(index, 0, 0), dia[self.mjdTime], dia[self.ra], dia[self.dec], dia[self.sourceId], out, self.config)
+            with metrics.timer("compile"):
+                compileKernels(sigs)
+
+        def collect(results):
+            for n, worker, chunkMetrics in results:
+                metrics.merge(chunkMetrics, worker=worker)
+                if progress is not None:
+                    progress.update(n)
+
+        try:
+            if nworkers > 1 and len(chunks):
+                import multiprocessing, tempfile
+                with tempfile.TemporaryDirectory(dir="/dev/shm" if os.path.isdir("/dev/shm") else None) as scratch:
+                    # the arrays, as the workers will open them (see MockLinker)
+                    arrays = [ ("dia", dia, False), ("perm", perm, False), ("offsets", offsets, False), ("obj", out, True), ("done", done, True) ]
+                    shared = [ _shareable(arr, os.path.join(scratch, f"{name}.npy"), writable) if arr is not None else (None, False)
+                               for name, arr, writable in arrays ]
+                    specs = [ spec for spec, _ in shared ]
+                    mdia, mperm, moffsets, mout, mdone = [ _openSpec(spec) if spec is not None else None for spec in specs ]
+                    compile(mdia, (mperm, moffsets), mout)
+
+                    with metrics.timer("link"):
+                        ctx = multiprocessing.get_context("forkserver")
+                        with ctx.Pool(nworkers, initializer=_init_worker, initargs=(self, specs, chunksize)) as pool:
+                            collect(pool.imap_unordered(_link_chunk, chunks))
+                            pool.close()
+                            pool.join()
+
+                    # copy the results back from the scratch copies
+                    for (_, arr, _), (_, copied), marr in zip(arrays[3:], shared[3:], [mout, mdone]):
+                        if copied:
+                            arr[:] = marr
+            else:
+                compile(dia, index, out)
+                _shared = (self, dia, index, out, done, chunksize)
+                with metrics.timer("link"):
+                    collect(_link_chunk(c) for c in chunks)
+        finally:
+            _shared = None
+            if progress is not None:
+                progress.close()
+
+        return out
+
+###########################################################
 
 if __name__ == "__main__":
     import pandas as pd
@@ -257,8 +1549,13 @@ if __name__ == "__main__":
     del df
     print(f"{obsv.dtype=}\n{len(obsv)=}")
 
+    # dictionary-encode the object names, so that grouping and filtering
+    # work on integers
+    codes, names = encodeIds(obsv["_name"])
+    _, *index = groupBy(codes, obsv["midPointTai"])
+
     # go!
-    obj = linkObservations(obsv, objectId="_name")
+    obj = linkObservations({ **{ col: obsv[col] for col in obsv.dtype.names }, "_name": codes }, objectId="_name", names=names, index=index)
 
     # print some nice results
     print("Found:", (~np.isnan(obj["discoverySubmissionDate"])).sum())
@@ -268,14 +1565,12 @@ if __name__ == "__main__":
     # filter out the observations of objects that weren't found
     import time
     start = time.perf_counter()
-    found = obj["ssObjectId"][ ~np.isnan(obj["discoverySubmissionDate"]) ]
-    obsv_found = obsv[ np.isin(obsv["_name"], found) ]
+    obsv_found, obsv_missed = partitionObservations(obj, index, obsv)
     end = time.perf_counter()
     print(f"Observation filtering time: {end-start:.3f} seconds")
     print(pd.DataFrame(obsv_found[ np.isin(obsv_found["_name"], objsample["ssObjectId"]) ]).groupby("_name").count())
 
     # basic sanity checks
-    obsv_missed = obsv[ ~np.isin(obsv["_name"], found) ]
     print(f"{len(obsv_found)=}")
     print(f"{len(obsv_missed)=}")
     assert len(obsv_found) + len(obsv_missed) == len(obsv)
@@ -2,13 +2,46 @@
 
 import numpy as np
 import mmap, os, pickle
-from miniDifi import MockLinker
+from miniDifi import MockLinker, Metrics, groupBy, objectDtype
 
-MAP_POPULATE = 0x08000
+MADV_POPULATE_READ = 22    # (Linux 5.14+)
 MAP_LOCKED = 0x2000
 
-def openOrCreateArray(dbfn, mode="r", nrows=None, dtype=None, clobber=False):
-    """ Opens (or creates) a memory-mapped numpy array """
+def _readNpyHeader(dbfn):
+    """ Returns (dtype, nrows, offset) of a .npy file, or None if dbfn isn't one """
+    with open(dbfn, "rb") as ff:
+        if ff.read(len(np.lib.format.MAGIC_PREFIX)) != np.lib.format.MAGIC_PREFIX:
+            return None
+        ff.seek(0)
+        version = np.lib.format.read_magic(ff)
+        readHeader = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = readHeader(ff)
+        assert len(shape) == 1 and not fortran_order, f"{dbfn}: expected a 1-D array"
+        return dtype, shape[0], ff.tell()
+
+def _npyHeader(dtype, nrows):
+    """ A .npy header for a 1-D array of nrows rows of dtype """
+    import io
+    ff = io.BytesIO()
+    np.lib.format.write_array_header_2_0(ff, dict(descr=np.lib.format.dtype_to_descr(dtype), fortran_order=False, shape=(nrows,)))
+    return ff.getvalue()
+
+def openOrCreateArray(dbfn, mode="r", nrows=None, dtype=None, clobber=False, populate=False):
+    """ Opens (or creates) a memory-mapped numpy array
+
+        New arrays are stored as .npy files (so they're self-describing,
+        and can be opened with np.load(..., mmap_mode="r")). Legacy raw
+        files, with the dtype pickled into a .dtype sidecar, can still be
+        opened.
+
+        If populate is True, the whole file is paged in up front
+        (MADV_POPULATE_READ); otherwise pages are read lazily, as they're
+        touched.
+
+        Returns (arr, mm, fd): arr is an np.memmap, so other processes can
+        open the same file by its name (see miniDifi.MockLinker); mm is
+        the underlying mmap.
+    """
     dtypefn = dbfn + ".dtype"
 
     if clobber:
@@ -18,46 +51,82 @@ def openOrCreateArray(dbfn, mode="r", nrows=None, dtype=None, clobber=False):
             except FileNotFoundError:
                 pass
 
-    _load_dtype = dtype is None
-    if _load_dtype:
-        import pickle
-        with open(dtypefn, "rb") as ff:
-            dtype = pickle.load(ff)
-
-    if nrows is None:
-        filesize = os.path.getsize(dbfn)
-        assert filesize % dtype.itemsize == 0
-        nrows = filesize // dtype.itemsize
-        print(f"Inferring {nrows:,} rows in {dbfn}")
-
+    # figure out the layout of an existing file
+    offset = 0
     if os.path.exists(dbfn):
-        # if the file exists, the size must match the expectation
-        assert nrows*dtype.itemsize == os.path.getsize(dbfn)
-        print(f"Opening existing file {dbfn}")
+        header = _readNpyHeader(dbfn)
+        if header is not None:
+            fdtype, fnrows, offset = header
+        else:
+            # legacy raw file + pickled dtype
+            with open(dtypefn, "rb") as ff:
+                fdtype = pickle.load(ff)
+            filesize = os.path.getsize(dbfn)
+            assert filesize % fdtype.itemsize == 0
+            fnrows = filesize // fdtype.itemsize
+
+        # if the file exists, it must match the expectation
+        assert dtype is None or np.dtype(dtype) == fdtype, f"{dbfn} has dtype {fdtype}, expected {dtype}"
+        assert nrows is None or nrows == fnrows, f"{dbfn} has {fnrows:,} rows, expected {nrows:,}"
+        dtype, nrows = fdtype, fnrows
+        print(f"Opening existing file {dbfn} ({nrows:,} rows)")
+    else:
+        assert mode == "w" and nrows is not None and dtype is not None, f"{dbfn} doesn't exist, and can't be created"
+        dtype = np.dtype(dtype)
 
     if mode == "r":
         osmode = os.O_RDONLY
-        prot = mmap.PROT_READ
     elif mode == "w":
         osmode = os.O_RDWR | os.O_CREAT
-        prot = mmap.PROT_WRITE | mmap.PROT_READ
     else:
         raise Exception(f"Unknown mode {mode}")
 
     fp = os.open(dbfn, osmode)
-    if osmode & os.O_RDWR:
-        os.ftruncate(fp, nrows*dtype.itemsize)
-    mm = mmap.mmap(fp, 0, flags=mmap.MAP_SHARED | MAP_POPULATE, prot=prot)
-    arr = np.ndarray(shape=(nrows,), dtype=dtype, buffer=mm)
-
-    # store dtype
-    if not _load_dtype:
-        import pickle
-        with open(dtypefn, "wb") as ff:
-            pickle.dump(dtype, ff, protocol=pickle.HIGHEST_PROTOCOL)
+    if osmode & os.O_RDWR and os.fstat(fp).st_size == 0:
+        # a new file: write the header, and extend it to full size (the
+        # data is zero-filled, lazily, by the filesystem)
+        header = _npyHeader(dtype, nrows)
+        os.write(fp, header)
+        offset = len(header)
+        os.ftruncate(fp, offset + nrows*dtype.itemsize)
+
+    # (mode "r+" maps the file shared, so writes go to the file)
+    arr = np.memmap(dbfn, dtype=dtype, mode="r" if mode == "r" else "r+", offset=offset, shape=(nrows,))
+    mm = arr.base
+    if populate:
+        try:
+            mm.madvise(MADV_POPULATE_READ)
+        except OSError:
+            # an older kernel; ask for a readahead instead
+            mm.madvise(mmap.MADV_WILLNEED)
 
     return arr, mm, fp
 
+def openOrCreateIndex(dbfn, dia, objectId="ssObjectId", mjdTime="midPointTai"):
+    """ Opens (or builds and stores) the (perm, offsets) group-by index of dia """
+    base = dbfn[:-len(".npy")] if dbfn.endswith(".npy") else dbfn
+    permfn, offsetsfn = f"{base}.perm.npy", f"{base}.offsets.npy"
+
+    if not (os.path.exists(permfn) and os.path.exists(offsetsfn)):
+        print(f"Building the group-by index for {dbfn}... ", end='', flush=True)
+        _, perm, offsets = groupBy(dia[objectId], dia[mjdTime], parallel=True)
+        for fn, data in [(permfn, perm), (offsetsfn, offsets)]:
+            # write to a temporary file first, so a crash can't leave a
+            # truncated index behind
+            with open(fn + ".tmp", "wb") as ff:
+                np.save(ff, data)
+            os.rename(fn + ".tmp", fn)
+        print("done.")
+
+    perm, _, _ = openOrCreateArray(permfn)
+    offsets, _, _ = openOrCreateArray(offsetsfn)
+
+    # a stored index must be the index of this dia (e.g., not of an
+    # earlier version of it); delete the files to have it rebuilt
+    assert len(perm) == len(dia), f"{permfn} indexes {len(perm):,} rows, but {dbfn} has {len(dia):,}"
+    assert len(offsets) and offsets[-1] == len(dia), f"{offsetsfn} doesn't match {dbfn} ({len(dia):,} rows)"
+    return perm, offsets
+
 if __name__ == "__main__":
     # flip this to True to store the output, if you have permissions to
     # write to {output_dir}/ssObject.npy (i.e., if you're mjuric).
@@ -76,23 +145,38 @@ if __name__ == "__main__":
     output_dir = "/astro/users/mjuric/projects/github.com/mjuric/ssp-ddpp/outputs/oct2023_v3.0_mpcorb/"
     diaFn = f"{output_dir}/diaSource.npy"
     objFn = f"{output_dir}/ssObject.npy"
+    doneFn = f"{output_dir}/ssObject.done.npy"
 
-    # open input/output arrays
+    # open the input array, and (or build, the first time around) its
+    # group-by index
     dia, dia_mm, dia_fp = openOrCreateArray(diaFn)
+    index = openOrCreateIndex(diaFn, dia)
+
+    # open (or create) the output array, and the journal of objects that
+    # have been linked already. If a previous run was interrupted, it'll
+    # pick up where it left off.
     if storeResult:
-        obj, obj_mm, obj_fp = openOrCreateArray(objFn, mode="w")
+        nobj = len(index[1]) - 1
+        obj, obj_mm, obj_fp = openOrCreateArray(objFn, mode="w", nrows=nobj, dtype=objectDtype(dia.dtype["ssObjectId"]))
+        done, done_mm, done_fp = openOrCreateArray(doneFn, mode="w", nrows=nobj, dtype=np.uint8)
     else:
-        obj = None
-
-    # open splits
-    print("Loading splits... ", end='', flush=True)
-    with open(f"{output_dir}/splits.pkl", "rb") as ff:
-        splits = pickle.load(ff)
-    print("done.")
+        obj = done = None
 
     # "link"
     from tqdm import tqdm
-    linker = MockLinker(config)
-    obj = linker.link_all(dia, splits, chunksize=1000, tqdm=tqdm, nworkers=48, obj=obj)
+    metrics = Metrics()
+    with metrics.timer("total"):
+        linker = MockLinker(config)
+        obj = linker.link_all(dia, index, chunksize=1000, tqdm=tqdm, nworkers=48, obj=obj, done=done, metrics=metrics)
+        if storeResult:
+            with metrics.timer("output"):
+                obj_mm.flush()
+                done_mm.flush()
+
+    # store the metrics (per-stage timings, rates, per-worker breakdowns)
+    if storeResult:
+        with open(f"{output_dir}/ssObject.metrics.json", "w") as fp:
+            fp.write(metrics.json(indent=2))
+    print(", ".join(f"{k}={v:.1f}s" for k, v in metrics.timers.items()), f"({metrics.asdict().get('objects_per_second', 0):,.0f} obj/s)")
 
     print("Found:", (~np.isnan(obj["discoverySubmissionDate"])).sum())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Regression and throughput harness for the miniDifi linking engines
+#
+# Runs every engine on the validation set (midobs1000tnos.csv), asserts
+# they all give identical results to the reference (per-object) engine --
+# and, optionally, to results stored by an earlier run -- and records each
+# engine's throughput, so that speed work can't quietly change the science.
+#
+# Example:
+#
+#   ./validate.py                                    # check all engines
+#   ./validate.py --save-reference ref.npy           # store the results ...
+#   ./validate.py --reference ref.npy                # ... and check against them later
+#
+# Exits with a non-zero status if any engine disagrees.
+#
+
+import numpy as np
+import os, sys, time, json
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+from benchmark import git_commit
+
+# the columns that must match exactly
+checkColumns = ["ssObjectId", "discoveryObservationId", "discoverySubmissionDate", "discoveryChances"]
+
+def load_validation_set(fn=os.path.join(here, "midobs1000tnos.csv")):
+    import pandas as pd
+    df = pd.read_csv(fn).drop(columns=["Unnamed: 0"])
+    nameLen = df["ssObjectId"].str.len().max()
+    return np.asarray(df.to_records(index=False, column_dtypes=dict(ssObjectId=f'a{nameLen}', diaSourceId='u8', midPointTai='f8', ra='f8', decl='f8')))
+
+def run_object(obsv, config, **kwargs):
+    import miniDifi as md
+    return md.linkObservations(obsv, engine="object")
+
+def run_batched(obsv, config, **kwargs):
+    import miniDifi as md
+    return md.linkObservations(obsv, engine="batched")
+
+def run_multiprocess(obsv, config, nworkers=2, **kwargs):
+    import miniDifi as md
+    _, perm, offsets = md.groupBy(obsv["ssObjectId"], obsv["midPointTai"])
+    return md.MockLinker(config).link_all(obsv, (perm, offsets), chunksize=100, nworkers=nworkers)
+
+def run_stream(obsv, config, **kwargs):
+    import miniDifi as md
+
+    class Collect:
+        def __init__(self):
+            self.parts = []
+        def write(self, obj):
+            self.parts.append(obj)
+
+    # the stream must be clustered by object; use small chunks, so that
+    # objects get split between them
+    _, perm, _ = md.groupBy(obsv["ssObjectId"], obsv["midPointTai"])
+    sobsv = obsv[perm]
+    chunks = ( { name: sobsv[name][b:b+1000] for name in sobsv.dtype.names } for b in range(0, len(sobsv), 1000) )
+    writer = Collect()
+    md.linkStream(chunks, writer, config=config)
+    return np.concatenate(writer.parts)
+
+def run_incremental(obsv, config, **kwargs):
+    import miniDifi as md
+    night = obsv["midPointTai"].astype(np.int64)
+    linker = md.IncrementalLinker(config)
+    for n in np.unique(night):
+        linker.update(obsv[night == n])
+    return linker.results()
+
+engines = {
+    "object": run_object,
+    "batched": run_batched,
+    "multiprocess": run_multiprocess,
+    "stream": run_stream,
+    "incremental": run_incremental,
+}
+
+def _run(engine, nworkers):
+    # run one engine (twice: the first run compiles or loads the kernels).
+    # Returns (results, seconds).
+    import io, contextlib
+    from miniDifi import config
+
+    obsv = load_validation_set()
+    with contextlib.redirect_stdout(io.StringIO()):
+        engines[engine](obsv, config, nworkers=nworkers)
+        t0 = time.perf_counter()
+        obj = engines[engine](obsv, config, nworkers=nworkers)
+        seconds = time.perf_counter() - t0
+
+    # in a canonical (ssObjectId) order, for comparison
+    return obj[np.argsort(obj["ssObjectId"], kind="stable")], seconds
+
+def compare(obj, ref):
+    # the list of (column, number of mismatched rows) that differ
+    if len(obj) != len(ref):
+        return [ ("rows", abs(len(obj) - len(ref))) ]
+    diffs = []
+    for name in checkColumns:
+        a, b = obj[name], ref[name]
+        same = (a == b) | (np.isnan(a) & np.isnan(b)) if a.dtype.kind == "f" else (a == b)
+        if not same.all():
+            diffs.append((name, int((~same).sum())))
+    return diffs
+
+def main():
+    import argparse, platform, datetime
+
+    parser = argparse.ArgumentParser(description='Check that all miniDifi engines agree on the validation set, and measure their throughput.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--engines', type=str, nargs='+', choices=list(engines), default=list(engines), help='Engines to run (the first one is the reference).')
+    parser.add_argument('--nworkers', type=int, default=2, help='Number of workers for the multiprocess engine.')
+    parser.add_argument('--reference', type=str, default=None, help='Stored results (.npy) to check all engines against.')
+    parser.add_argument('--save-reference', type=str, default=None, help='Store the results of the first engine to this file (.npy).')
+    parser.add_argument('--output', type=str, default=None, help='File to append the (JSON lines) throughput results to.')
+    args = parser.parse_args()
+
+    results = { engine: _run(engine, args.nworkers) for engine in args.engines }
+
+    refName = args.engines[0]
+    ref = results[refName][0]
+    if args.save_reference is not None:
+        np.save(args.save_reference, ref)
+    stored = np.load(args.reference) if args.reference is not None else None
+
+    ok = True
+    meta = dict(date=datetime.datetime.now(datetime.timezone.utc).isoformat(), commit=git_commit(), host=platform.node(), python=platform.python_version())
+    for engine, (obj, seconds) in results.items():
+        diffs = compare(obj, ref)
+        if stored is not None:
+            diffs += [ (f"{name} (vs. {args.reference})", n) for name, n in compare(obj, stored) ]
+        ok &= not diffs
+
+        nfound = int((~np.isnan(obj["discoverySubmissionDate"])).sum())
+        status = "OK" if not diffs else "MISMATCH: " + ", ".join(f"{name} ({n} rows)" for name, n in diffs)
+        print(f"{engine:12s} objects={len(obj):,} found={nfound:,} time={seconds:.3f}s ({len(obj) / seconds:,.0f} obj/s)  {status}")
+
+        if args.output is not None:
+            with open(args.output, "a") as fp:
+                fp.write(json.dumps(dict(engine=engine, nobj=len(obj), nfound=nfound, seconds=seconds, objects_per_second=len(obj) / seconds,
+                                         nworkers=args.nworkers if engine == "multiprocess" else None, identical=not diffs, **meta)) + "\n")
+
+    if not ok:
+        print("FAILED: some engines disagree.")
+        sys.exit(1)
+    print("All engines agree.")
+
+if __name__ == "__main__":
+    main()